@@ -1,4 +1,6 @@
+from array import array
 from collections import Counter, defaultdict
+from functools import lru_cache
 from string import punctuation
 from itertools import chain, combinations
 import itertools
@@ -7,11 +9,12 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 import re
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, hstack
 from sklearn.cross_validation import KFold
 from sklearn.linear_model import LogisticRegression
 import tarfile
 import urllib.request
+import zlib
 
 
 def download_data():
@@ -136,20 +139,19 @@ def token_pair_features(tokens, feats, k=3):
     """
     ###TODO
     pass
-    combined_list = []
-
-    for i in range(len(tokens) - k + 1):
-        l = []
-        for j in range(i, i + k):
-            l.append(tokens[j])
-            l1 = list(combinations(l, 2))
-        for i in l1:
-            combined_list.append(i)
-    c = dict(Counter(combined_list))
-    for k, v in c.items():
-        k1 = tuple(k)
-        new_key = 'token_pair=' + k1[0] + '__' + k1[1]
-        feats[new_key] = v
+    # Intern the tokens, view the id array as its n-k+1 windows without
+    # copying, and encode each (earlier, later) pair as one int64 key.
+    if len(tokens) < k or k < 2:
+        return
+    names, ids = np.unique(np.asarray(tokens), return_inverse=True)
+    ids = ids.astype(np.int64).reshape(-1)
+    windows = np.lib.stride_tricks.as_strided(ids, shape=(len(ids) - k + 1, k),
+                                              strides=(ids.strides[0], ids.strides[0]), writeable=False)
+    keys = np.concatenate([windows[:, a] * len(names) + windows[:, b] for a, b in combinations(range(k), 2)])
+    keys, counts = np.unique(keys, return_counts=True)
+    names = names.tolist()
+    for key, v in zip(keys.tolist(), counts.tolist()):
+        feats['token_pair=' + names[key // len(names)] + '__' + names[key % len(names)]] = v
 
 neg_words = set(['bad', 'hate', 'horrible', 'worst', 'boring'])
 pos_words = set(['awesome', 'amazing', 'best', 'good', 'great', 'love', 'wonderful'])
@@ -206,7 +208,62 @@ def featurize(tokens, feature_fns):
     return sorted(feats.items())
 
 
-def vectorize(tokens_list, feature_fns, min_freq, vocab=None):
+@lru_cache(maxsize=1 << 16)
+def feature_column(name, n_features):
+    """
+    Column and sign of a feature name for the hashing trick. The CRC-32 of
+    the name is stable across runs and processes (unlike hash()); its low
+    bits pick the column and its top bit the sign, so colliding features
+    tend to cancel rather than add up. The cache is bounded, so memory does
+    not grow with the number of distinct features.
+    Params:
+      name.........feature name, e.g. 'token=great'
+      n_features...number of columns (at most 2**31)
+    Returns:
+      (column, sign) with sign 1 or -1.
+    >>> feature_column('token=great', 2**20)
+    (424015, -1)
+    """
+    h = zlib.crc32(name.encode('utf-8'))
+    return h % n_features, -1 if h & 0x80000000 else 1
+
+
+def hash_vectorize(tokens_list, feature_fns, n_features=2**20):
+    """
+    Vectorize documents with the hashing trick: each feature goes to the
+    column given by feature_column, so no vocabulary is built or needed, and
+    each row depends only on its own document. Rows are appended to the CSR
+    arrays as they are computed, so memory is bounded by the output.
+    Params:
+      tokens_list...a list of token arrays, one per document
+      feature_fns...a list of functions, one per feature
+      n_features....number of columns
+    Returns:
+      a csr_matrix of shape (len(tokens_list), n_features).
+    >>> X = hash_vectorize([np.array(['good', 'good', 'movie'])], [token_features], 2**20)
+    >>> sorted(zip(X.indices.tolist(), X.data.tolist()))
+    [(155613, -2), (809087, -1)]
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    for tokens in tokens_list:
+        row = {}
+        for name, value in featurize(tokens, feature_fns):
+            if value > 0:
+                col, sign = feature_column(name, n_features)
+                row[col] = row.get(col, 0) + sign * value
+        for col in sorted(row):
+            if row[col]:
+                indices.append(col)
+                data.append(row[col])
+        indptr.append(len(indices))
+
+    return csr_matrix((np.array(data, dtype='int64'), np.array(indices, dtype='int32'), np.array(indptr, dtype='int64')),
+                      shape=(len(tokens_list), n_features))
+
+
+def vectorize(tokens_list, feature_fns, min_freq, vocab=None, hashing=False, n_features=2**20):
     """
     Given the tokens for a set of documents, create a sparse
     feature full_matrix, where each row represents a document, and
@@ -217,6 +274,9 @@ def vectorize(tokens_list, feature_fns, min_freq, vocab=None):
       feature_fns...a list of functions, one per feature
       min_freq......Remove features that do not appear in
                     at least min_freq different documents.
+      vocab.........an existing vocab to use (e.g. from the training data)
+      hashing.......if True, use hash_vectorize with n_features columns;
+                    min_freq and vocab are then ignored and vocab is None
     Returns:
       - a csr_matrix: See https://goo.gl/f5TiF1 for documentation.
       This is a sparse full_matrix (zero values are not stored).
@@ -232,58 +292,63 @@ def vectorize(tokens_list, feature_fns, min_freq, vocab=None):
     <class 'scipy.sparse.csr.csr_matrix'>
     >>> X.toarray()
     array([[1, 0, 1, 1, 1, 1],
-           [0, 2, 0, 1, 0, 0]], dtype=int64)
+           [0, 2, 0, 1, 0, 0]], dtype=int32)
     >>> sorted(vocab.items(), key=lambda x: x[1])
     [('token=great', 0), ('token=horrible', 1), ('token=isn', 2), ('token=movie', 3), ('token=t', 4), ('token=this', 5)]
     """
     ###TODO
     pass
-    feature = {}
-    feat = defaultdict(list)
-    index = []
-    count = 0
-    
-    j = 0
-    for i in tokens_list:
-        new_dict = defaultdict(list)
-        feature[count] = featurize(i, feature_fns)
-        
-        for val in feature[count]:
-            if val[1] > 0:
-                new_dict[val[0]] = val[1]
-                if val[0] in feat:
-                         feat[val[0]] += 1
-                else:
-                         feat[val[0]] = 1
-        index.append(new_dict)
-        count += 1
-        
-    i = 0
-    if vocab == None:
-        vocab = defaultdict()
-        for k,v in sorted(feat.items()):
-            if v >= min_freq:
-                vocab[k] = i
-                i += 1
-    
-    row = []
-    data = []
-    col = []
-    j = 0
-    for k in index:
-        for f in k:
-            if f in vocab:
-                col.append(vocab[f])
-                row.append(j)
-                data.append(k[f])
-        j = j+1
-    
-    data1 = np.array(data, dtype='int64')
-    row1 = np.array(row, dtype='int64')
-    col1 = np.array(col, dtype='int64')
-    
-    matrix = csr_matrix((data1,(row1, col1)))
-    
+    if hashing:
+        return hash_vectorize(tokens_list, feature_fns, n_features), None
+
+    # One pass: each document's features are appended to typed CSR buffers
+    # under provisional column ids (first-seen order), counting document
+    # frequencies on the way. The vocabulary is then the alphabetically
+    # sorted features with enough documents, and a remap array renumbers
+    # the buffered columns, dropping the rest.
+    fixed_vocab = vocab is not None
+    columns = vocab if fixed_vocab else {}
+    doc_freq = array('i')
+    indptr = array('q', [0])
+    indices = array('i')
+    data = array('i')
+    for tokens in tokens_list:
+        feats = defaultdict(lambda: 0)
+        for fn in feature_fns:
+            fn(tokens, feats)
+        for name, value in feats.items():
+            if value > 0:
+                col = columns.get(name)
+                if col is None:
+                    if fixed_vocab:
+                        continue
+                    col = columns[name] = len(doc_freq)
+                    doc_freq.append(0)
+                if not fixed_vocab:
+                    doc_freq[col] += 1
+                indices.append(col)
+                data.append(value)
+        indptr.append(len(indices))
+
+    indptr = np.array(indptr, dtype=np.int64)
+    indices = np.array(indices, dtype=np.int32)
+    data = np.array(data, dtype=np.int32)
+    if not fixed_vocab:
+        names = list(columns)
+        doc_freq = np.array(doc_freq, dtype=np.int32)
+        vocab = {}
+        remap = np.full(len(names), -1, dtype=np.int32)
+        for name in sorted(names[c] for c in np.flatnonzero(doc_freq >= min_freq)):
+            remap[columns[name]] = vocab[name] = len(vocab)
+        indices = remap[indices]
+        keep = indices >= 0
+        indptr = np.concatenate(([0], np.cumsum(keep)))[indptr]
+        indices = indices[keep]
+        data = data[keep]
+
+    matrix = csr_matrix((data, indices, indptr), shape=(len(tokens_list), len(vocab)))
+    matrix.sort_indices()
+
     return matrix, vocab
 
 def accuracy_score(truth, predicted):
@@ -329,6 +394,55 @@ def cross_validation_accuracy(clf, X, labels, k):
 
 
 
+def feature_blocks(tokens_list, feature_fns):
+    """
+    Vectorize the documents once per feature function, keeping every
+    feature (min_freq=1), for eval_all_combinations to reuse.
+    Params:
+      tokens_list...a list of token arrays, one per document
+      feature_fns...a list of feature functions
+    Returns:
+      A dict from each feature function to (X, names, doc_freq): its count
+      matrix, the feature name of each column and the number of documents
+      each feature appears in.
+    """
+    blocks = {}
+    for fn in feature_fns:
+        X, vocab = vectorize(tokens_list, [fn], 1)
+        blocks[fn] = (X, sorted(vocab, key=vocab.get), np.bincount(X.indices, minlength=X.shape[1]))
+
+    return blocks
+
+
+def combine_blocks(blocks, feature_fns, min_freq):
+    """
+    Build the matrix vectorize(tokens_list, feature_fns, min_freq) would
+    return from cached feature_blocks: drop the columns of each block with
+    fewer than min_freq documents, stack the blocks side by side and put the
+    columns in alphabetical order of their names. This relies on different
+    feature functions producing different feature names, as they do here.
+    Returns:
+      X, vocab as vectorize returns them.
+    >>> tokens_list = [tokenize(d) for d in ["great great movie", "bad movie"]]
+    >>> blocks = feature_blocks(tokens_list, [token_features, lexicon_features])
+    >>> X, vocab = combine_blocks(blocks, [token_features, lexicon_features], 2)
+    >>> X.toarray().tolist(), vocab
+    ([[1], [1]], {'token=movie': 0})
+    """
+    matrices = []
+    names = []
+    for fn in feature_fns:
+        X, fn_names, doc_freq = blocks[fn]
+        keep = np.flatnonzero(doc_freq >= min_freq)
+        matrices.append(X[:, keep])
+        names.extend(fn_names[c] for c in keep)
+    order = sorted(range(len(names)), key=names.__getitem__)
+    X = hstack(matrices, format='csr')[:, order]
+    X.sort_indices()
+
+    return X, {names[c]: i for i, c in enumerate(order)}
+
+
 def eval_all_combinations(docs, labels, punct_vals,
                           feature_fns, min_freqs):
     """
@@ -375,10 +489,13 @@ def eval_all_combinations(docs, labels, punct_vals,
         tokens_list = []
         for doc in docs:
             tokens_list.append(tokenize(doc,val))
+        # Featurize once per feature function; each setting below only
+        # selects and stacks columns.
+        blocks = feature_blocks(tokens_list, feature_fns)
         for minf in min_freqs:
             for combo in feature_combo:
                 clf = LogisticRegression()
-                X,r_vocab = vectorize(tokens_list,combo,minf)
+                X,r_vocab = combine_blocks(blocks,combo,minf)
                 cva =cross_validation_accuracy(clf,X,labels,5)
                 temp_dic = {}
                 temp_dic['punct'] = val
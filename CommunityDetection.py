@@ -3,12 +3,26 @@
 
 # In[35]:
 
-from collections import Counter, defaultdict, deque
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
 import copy
+from functools import partial
+import itertools
+import gzip
+import hashlib
+import heapq
+import json
 import math
+from multiprocessing import Pool
 import networkx as nx
+import numpy as np
+import os
+import random
+from scipy.sparse import csr_matrix
+import sys
+import time
 import urllib.request
 import operator
+import weakref
 
 
 ## Community Detection
@@ -64,43 +78,24 @@ def bfs(graph, root, max_depth):
     ###TODO
     pass
 
+    node2distances = {root: 0}
+    node2num_paths = {root: 1}
     node2parents = {}
-    node2distances = {}
-    node2num_paths = {}
-    visiting = deque()
-    visited = deque()
-    
-    nodes = graph.nodes()
-    visited={x:"No" for x in nodes}
-    visiting.append(root)
-    distance= {x:float("inf") for x in nodes}
-    distance[root] = 0
-    parents = {x:[] for x in nodes} 
-    parents[root] = root
-  
+    visiting = deque([root])
+
     while(len(visiting) > 0):
         c = visiting.popleft()
-        child = graph.neighbors(c)
-            
-        for node in child:
-            if(distance[c] > max_depth):
-                break
-            if(visited[node] == "No"):
-                if(distance[node] < distance[c]):
-                    break
-                elif(distance[node] > distance[c] ):
-                    distance[node] = distance[c] + 1
-                    parents[node].append(c)
-                    visiting.append(node)
-
-        visited[c] = "Yes"
-        
-    for node in visited:
-        if(visited[node] == "Yes"):
-            node2distances[node] = distance[node]
-            node2num_paths[node] = len(parents[node])
-            if(node != root):
-                node2parents[node] = parents[node]
+        if(node2distances[c] >= max_depth):
+            continue
+        for node in graph.neighbors(c):
+            if(node not in node2distances):
+                node2distances[node] = node2distances[c] + 1
+                node2num_paths[node] = 0
+                node2parents[node] = []
+                visiting.append(node)
+            if(node2distances[node] == node2distances[c] + 1):
+                node2num_paths[node] += node2num_paths[c]
+                node2parents[node].append(c)
 
     return node2distances, node2num_paths, node2parents
 
@@ -157,50 +152,537 @@ def bottom_up(root, node2distances, node2num_paths, node2parents):
     ###TODO
     pass
 
+    result = {}
+    credit = {n: 1. for n in node2distances}
 
-    result = defaultdict()
-    edge_value = deque()
-    node_value = {}
-    
-    for n in node2distances:
-        node_value[n] = 1
-    
-    for nv in node_value:
-        nv = {k:1 for k in node2distances.keys()}
-     
-    for key in sorted(node2distances, key=node2distances.get,reverse=True):
+    for key in sorted(node2distances, key=node2distances.get, reverse=True):
         if(key != root):
             for parent in node2parents[key]:
-                nv[parent] = nv[parent] + (nv[key]/len(node2parents[key]))
+                value = credit[key] * node2num_paths[parent] / node2num_paths[key]
+                credit[parent] += value
                 if(key > parent):
-                    edge_value.append((parent, key))
-                elif(key < parent):
-                    edge_value.append((key, parent))
-   
-    for ev in edge_value:
-        if( root in ev):
-            root_index = ev.index(root)
-            if(root_index > 0):
-                result[ev] = (nv[ev[0]]/len(node2parents[ev[0]]))
-            else:
-                result[ev] = (nv[ev[1]]/len(node2parents[ev[1]]))
-        elif(ev[0] in node2parents[ev[1]]):
-            result[ev] = (nv[ev[1]]/len(node2parents[ev[1]]))
-        else:
-            result[ev] = (nv[ev[0]]/len(node2parents[ev[0]]))
+                    result[(parent, key)] = value
+                else:
+                    result[(key, parent)] = value
 
     return result
 
-def approximate_betweenness(graph, max_depth):
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'entries', 'bytes', 'max_bytes'])
+
+
+class ByteLRUCache(object):
+    """
+    A least-recently-used cache bounded by the approximate memory of its
+    values rather than by their number.
+    >>> cache = ByteLRUCache(100)
+    >>> cache.put('a', 1, 60)
+    >>> cache.put('b', 2, 60)
+    >>> cache.get('a'), cache.get('b')
+    (None, 2)
+    >>> cache.info()
+    CacheInfo(hits=1, misses=1, entries=1, bytes=60, max_bytes=100)
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value, nbytes):
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        if nbytes > self.max_bytes:
+            return
+        self.entries[key] = (value, nbytes)
+        self.bytes += nbytes
+        while self.bytes > self.max_bytes:
+            _, old_bytes = self.entries.popitem(last=False)[1]
+            self.bytes -= old_bytes
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, len(self.entries), self.bytes, self.max_bytes)
+
+
+# A cache for search results that path_score and the betweenness functions
+# use when it is passed to them as cache=bfs_cache (main does).
+bfs_cache = ByteLRUCache(256 << 20)
+
+_graph_tokens = weakref.WeakKeyDictionary()
+_next_token = itertools.count()
+
+
+def graph_key(graph):
+    """
+    Identify the current state of a graph for a ByteLRUCache: a token unique
+    to the graph object, its version counter (see mark_changed), its node
+    and edge counts and an order-independent checksum of its edges.
+    networkx graphs carry no modification counter, so the checksum is what
+    catches in-place edits that keep the counts, such as swapping an edge.
+    It costs one pass over the edges: compute it once and pass it as key=
+    to cached_bfs or path_score when searching from many roots.
+    >>> g = example_graph()
+    >>> before = graph_key(g)
+    >>> g.remove_edge('B', 'D'); g.add_edge('A', 'E')
+    >>> graph_key(g) == before
+    False
+    """
+    if graph not in _graph_tokens:
+        _graph_tokens[graph] = [next(_next_token), 0]
+    token, version = _graph_tokens[graph]
+    checksum = 0
+    size = 0
+    for a, b in getattr(graph, 'edges_iter', graph.edges)():
+        checksum ^= hash(frozenset((a, b)))
+        size += 1
+    return (token, version, len(graph), size, checksum)
+
+
+def mark_changed(graph):
+    """
+    Record that graph was modified, invalidating its cached entries even
+    when its edges are unchanged (e.g. after editing edge attributes).
+    """
+    if graph in _graph_tokens:
+        _graph_tokens[graph][1] += 1
+
+
+def _approx_bytes(value):
+    """
+    Rough memory of a search result made of dicts, lists and tuples. Node
+    names (strings) belong to the graph and are not counted. Dicts of
+    scalars are estimated from one sampled key and value, so this is much
+    cheaper than the search it measures.
+    """
+    if isinstance(value, dict):
+        size = sys.getsizeof(value)
+        if not value:
+            return size
+        key, sample = next(iter(value.items()))
+        if isinstance(key, tuple):
+            size += len(value) * sys.getsizeof(key)
+        if isinstance(sample, (dict, list, tuple)):
+            return size + sum(_approx_bytes(v) for v in value.values())
+        return size + len(value) * _approx_bytes(sample)
+    if isinstance(value, (list, tuple)):
+        if value and not isinstance(value[0], str):
+            return sys.getsizeof(value) + sum(_approx_bytes(v) for v in value)
+        return sys.getsizeof(value)
+    if isinstance(value, str):
+        return 0
+    return sys.getsizeof(value)
+
+
+def cached_bfs(graph, root, max_depth, cache=None, key=None):
+    """
+    bfs through a ByteLRUCache, keyed by (graph_key(graph), root, max_depth);
+    with cache=None this is plain bfs. key is graph_key(graph) computed by
+    the caller, so that searches from many roots walk the edges only once;
+    it must describe graph as it is now.
+    The returned dicts are shared with the cache and must not be modified.
+    >>> cache = ByteLRUCache(1 << 20)
+    >>> g = example_graph()
+    >>> first = cached_bfs(g, 'E', 2, cache)
+    >>> cached_bfs(g, 'E', 2, cache) is first
+    True
+    >>> g.remove_edge('D', 'E'); g.add_edge('A', 'E')
+    >>> cached_bfs(g, 'E', 2, cache)[0] == bfs(g, 'E', 2)[0]
+    True
+    >>> cache.info().hits, cache.info().misses
+    (1, 2)
+    >>> key = graph_key(g)
+    >>> cached_bfs(g, 'A', 2, cache, key) is cached_bfs(g, 'A', 2, cache, key)
+    True
+    """
+    if cache is None:
+        return bfs(graph, root, max_depth)
+    if key is None:
+        key = graph_key(graph)
+    key = ('bfs', key, root, max_depth)
+    result = cache.get(key)
+    if result is None:
+        result = bfs(graph, root, max_depth)
+        cache.put(key, result, _approx_bytes(result))
+    return result
+
+
+CSRGraph = namedtuple('CSRGraph', ['nodes', 'index', 'offsets', 'neighbors', 'edges', 'edge_ids'])
+
+
+def to_csr(graph):
+    """
+    Build an integer-indexed compressed sparse row (CSR) view of a graph.
+    Node i is the i-th node of graph.nodes(), and its neighbors are
+    neighbors[offsets[i]:offsets[i+1]], in graph.neighbors() order.
+    Every undirected edge gets an id; edges[eid] is the alphabetically
+    sorted tuple of its endpoint names, and edges are numbered in
+    alphabetical order. edge_ids is aligned with neighbors, so
+    edge_ids[j] is the id of the edge stored in slot j.
+    Params:
+      graph...A networkx Graph
+    Returns:
+      A CSRGraph namedtuple (nodes, index, offsets, neighbors, edges, edge_ids),
+      where index maps each node name to its integer id.
+    >>> csr = to_csr(example_graph())
+    >>> len(csr.nodes), len(csr.edges), len(csr.neighbors)
+    (7, 9, 18)
+    >>> sorted(csr.nodes[i] for i in csr.neighbors[csr.offsets[csr.index['D']]:csr.offsets[csr.index['D'] + 1]])
+    ['B', 'E', 'F', 'G']
+    >>> csr.edges[:3]
+    [('A', 'B'), ('A', 'C'), ('B', 'C')]
+    """
+    nodes = list(graph.nodes())
+    index = {n: i for i, n in enumerate(nodes)}
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    slots = []
+    for i, n in enumerate(nodes):
+        nbrs = list(graph.neighbors(n))
+        slots.extend((n, m) for m in nbrs)
+        offsets[i + 1] = offsets[i] + len(nbrs)
+
+    keys = [(a, b) if a < b else (b, a) for a, b in slots]
+    edges = sorted(set(keys))
+    edge_index = {e: i for i, e in enumerate(edges)}
+    neighbors = np.array([index[m] for n, m in slots], dtype=np.int32)
+    edge_ids = np.array([edge_index[k] for k in keys], dtype=np.int32)
+
+    return CSRGraph(nodes, index, offsets, neighbors, edges, edge_ids)
+
+
+def brandes_csr(csr, max_depth, roots=None):
+    """
+    Fused breadth-first search and bottom-up credit pass over a CSRGraph.
+    For each root this does the same work as bfs followed by bottom_up, but
+    on integer ids and flat lists that are allocated once and reset only
+    where a search touched them, and it adds each edge's credit straight
+    into one float list indexed by edge id. Nodes are credited in the same
+    order as bottom_up, so the sums are identical to the dict-based path.
+    Params:
+      csr.........A CSRGraph from to_csr.
+      max_depth...An integer representing the maximum depth to search.
+      roots.......Integer ids of the roots to search from (default: all nodes).
+    Returns:
+      A list of floats, one per edge id, holding the summed credit of that
+      edge over all roots (not yet divided by 2).
+    >>> csr = to_csr(example_graph())
+    >>> credit = brandes_csr(csr, 5, [csr.index['E']])
+    >>> [(e, c) for e, c in zip(csr.edges, credit) if c]
+    [(('A', 'B'), 1.0), (('B', 'C'), 1.0), (('B', 'D'), 3.0), (('D', 'E'), 4.5), (('D', 'G'), 0.5), (('E', 'F'), 1.5), (('F', 'G'), 0.5)]
+    """
+    adjacency, incident = csr_lists(csr)
+    n = len(adjacency)
+    if roots is None:
+        roots = range(n)
+
+    edge_credit = [0.] * len(csr.edges)
+    distance = [-1] * n
+    num_paths = [0] * n
+    credit = [0.] * n
+
+    for root in roots:
+        root_credit(adjacency, incident, root, max_depth, distance, num_paths, credit, edge_credit)
+
+    return edge_credit
+
+
+def csr_lists(csr):
+    """
+    Unpack a CSRGraph into per-node Python lists, which are much faster to
+    walk in a loop than numpy slices.
+    Returns:
+      adjacency...list, per node id, of neighbor ids.
+      incident....list, per node id, of (neighbor id, edge id) pairs.
+    """
+    offsets = csr.offsets.tolist()
+    neighbors = csr.neighbors.tolist()
+    edge_ids = csr.edge_ids.tolist()
+    n = len(offsets) - 1
+    adjacency = [neighbors[offsets[i]:offsets[i + 1]] for i in range(n)]
+    incident = [list(zip(neighbors[offsets[i]:offsets[i + 1]], edge_ids[offsets[i]:offsets[i + 1]]))
+                for i in range(n)]
+    return adjacency, incident
+
+
+def root_credit(adjacency, incident, root, max_depth, distance, num_paths, credit, out):
+    """
+    The per-root step of brandes_csr: a depth-limited bfs from root followed
+    by the bottom_up pass, adding each edge's credit to out[edge id].
+    distance, num_paths and credit are scratch lists sized to the graph;
+    distance must be all -1 and num_paths all 0 on entry, and they are left
+    that way on return.
+    Params:
+      adjacency...per-node neighbor ids (see csr_lists).
+      incident....per-node (neighbor id, edge id) pairs (see csr_lists).
+      root........integer id of the root.
+      max_depth...An integer representing the maximum depth to search.
+      out.........list indexed by edge id, or a defaultdict(float).
+    Returns:
+      The list of node ids reached, in discovery order.
+    """
+    distance[root] = 0
+    num_paths[root] = 1
+    order = [root]
+    head = 0
+    while head < len(order):
+        c = order[head]
+        head += 1
+        depth = distance[c]
+        if depth >= max_depth:
+            break
+        depth += 1
+        paths = num_paths[c]
+        for node in adjacency[c]:
+            if distance[node] < 0:
+                distance[node] = depth
+                order.append(node)
+            if distance[node] == depth:
+                num_paths[node] += paths
+
+    # Walk the levels deepest first, each level in discovery order.
+    for i in order:
+        credit[i] = 1.
+    end = len(order)
+    while end > 1:
+        depth = distance[order[end - 1]] - 1
+        start = end - 1
+        while distance[order[start - 1]] > depth:
+            start -= 1
+        for key in order[start:end]:
+            key_credit = credit[key]
+            key_paths = num_paths[key]
+            for parent, eid in incident[key]:
+                if distance[parent] == depth:
+                    value = key_credit * num_paths[parent] / key_paths
+                    credit[parent] += value
+                    out[eid] += value
+        end = start
+
+    for i in order:
+        distance[i] = -1
+        num_paths[i] = 0
+
+    return order
+
+
+# Roots are summed in blocks of this many, each block from zero, and the
+# block totals are then added in order. The blocks do not depend on the
+# number of workers, so serial and parallel runs give identical floats.
+BETWEENNESS_CHUNK = 256
+
+_worker_state = {}
+
+
+def _init_betweenness_worker(csr, max_depth):
+    """
+    Pool initializer: keep the CSRGraph in the worker so it is shipped
+    once per worker instead of once per chunk.
+    """
+    _worker_state['csr'] = csr
+    _worker_state['max_depth'] = max_depth
+
+
+def _run_chunk(job):
+    """
+    Pool task: kernel(csr, max_depth, roots) on the worker's CSRGraph.
+    """
+    kernel, roots = job
+    return kernel(_worker_state['csr'], _worker_state['max_depth'], roots)
+
+
+def _map_chunks(kernel, csr, max_depth, roots, workers):
+    """
+    Split roots into blocks of BETWEENNESS_CHUNK and yield
+    kernel(csr, max_depth, block) for each block, in block order, either
+    here or from a process pool. Only pool workers keep csr in
+    _worker_state; the serial path passes it directly.
+    """
+    if roots is None:
+        roots = range(len(csr.nodes))
+    roots = list(roots)
+    chunks = [roots[i:i + BETWEENNESS_CHUNK] for i in range(0, len(roots), BETWEENNESS_CHUNK)]
+
+    if workers is None or workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield kernel(csr, max_depth, chunk)
+        return
+
+    with Pool(workers, initializer=_init_betweenness_worker, initargs=(csr, max_depth)) as pool:
+        for block_credit in pool.imap(_run_chunk, [(kernel, chunk) for chunk in chunks]):
+            yield block_credit
+
+
+def sum_edge_credit(csr, max_depth, roots=None, workers=None):
+    """
+    Run brandes_csr over the roots in blocks of BETWEENNESS_CHUNK and add up
+    the block totals in block order.
+    Params:
+      csr.........A CSRGraph from to_csr.
+      max_depth...An integer representing the maximum depth to search.
+      roots.......Integer ids of the roots to search from (default: all nodes).
+      workers.....Number of worker processes; None or 1 runs in this process.
+    Returns:
+      A numpy float array, one entry per edge id, of summed credit (not yet
+      divided by 2).
+    """
+    edge_credit = np.zeros(len(csr.edges))
+    for block_credit in _map_chunks(brandes_csr, csr, max_depth, roots, workers):
+        edge_credit += block_credit
+    return edge_credit
+
+
+def brandes_sweep_csr(csr, max_depths, roots=None):
+    """
+    brandes_csr for several depths at once. One search to the largest depth
+    is shared by every depth: the levels up to depth d, and their path
+    counts, are exactly what a search limited to d would find. Only the
+    bottom-up pass is repeated per depth, over levels up to d, in the same
+    order as brandes_csr, so every depth's totals equal a separate
+    brandes_csr run.
+    Params:
+      csr..........A CSRGraph from to_csr.
+      max_depths...A list of ints, in increasing order.
+      roots........Integer ids of the roots to search from (default: all nodes).
+    Returns:
+      A list, per depth, of the per-edge credit lists brandes_csr returns.
+    >>> csr = to_csr(example_graph())
+    >>> brandes_sweep_csr(csr, [2, 5]) == [brandes_csr(csr, 2), brandes_csr(csr, 5)]
+    True
+    """
+    adjacency, incident = csr_lists(csr)
+    n = len(adjacency)
+    if roots is None:
+        roots = range(n)
+    max_depths = list(max_depths)
+    deepest = max_depths[-1] if max_depths else 0
+
+    edge_credit = [[0.] * len(csr.edges) for d in max_depths]
+    distance = [-1] * n
+    num_paths = [0] * n
+    credit = [0.] * n
+    parents = [None] * n
+
+    for root in roots:
+        distance[root] = 0
+        num_paths[root] = 1
+        order = [root]
+        head = 0
+        while head < len(order):
+            c = order[head]
+            head += 1
+            depth = distance[c]
+            if depth >= deepest:
+                break
+            depth += 1
+            paths = num_paths[c]
+            for node, eid in incident[c]:
+                if distance[node] < 0:
+                    distance[node] = depth
+                    parents[node] = []
+                    order.append(node)
+                if distance[node] == depth:
+                    num_paths[node] += paths
+                    parents[node].append((c, eid))
+
+        # levels[j] is the (start, end) slice of order holding level j.
+        levels = []
+        end = len(order)
+        while end > 0:
+            start = end - 1
+            while start > 0 and distance[order[start - 1]] == distance[order[end - 1]]:
+                start -= 1
+            levels.append((start, end))
+            end = start
+        levels.reverse()
+
+        for out, max_depth in zip(edge_credit, max_depths):
+            last = min(max_depth, len(levels) - 1)
+            for i in order[:levels[last][1]]:
+                credit[i] = 1.
+            for depth in range(last, 0, -1):
+                start, end = levels[depth]
+                for key in order[start:end]:
+                    key_credit = credit[key]
+                    key_paths = num_paths[key]
+                    for parent, eid in parents[key]:
+                        value = key_credit * num_paths[parent] / key_paths
+                        credit[parent] += value
+                        out[eid] += value
+
+        for i in order:
+            distance[i] = -1
+            num_paths[i] = 0
+            parents[i] = None
+
+    return edge_credit
+
+
+def sweep_betweenness(graph, max_depths, csr=None, workers=None, cache=None):
+    """
+    approximate_betweenness for several max_depth values from one search per
+    root (see brandes_sweep_csr).
+    Params:
+      graph........A networkx Graph
+      max_depths...A list of ints.
+      csr..........Optional CSRGraph for graph, from to_csr.
+      workers......Optional number of worker processes.
+      cache........Optional ByteLRUCache (e.g. bfs_cache) shared with
+                   approximate_betweenness: depths already in it are not
+                   recomputed, and the new ones are added to it.
+    Returns:
+      A dict from each max_depth to the dict approximate_betweenness(graph, max_depth)
+      returns.
+    >>> sweep = sweep_betweenness(example_graph(), [1, 2, 5])
+    >>> all(sweep[d] == approximate_betweenness(example_graph(), d) for d in [1, 2, 5])
+    True
+    """
+    depths = sorted(set(max_depths))
+    key = graph_key(graph) if cache is not None else None
+    result = {d: cache.get(('betweenness', key, d)) if cache is not None else None for d in depths}
+    missing = [d for d in depths if result[d] is None]
+    if missing:
+        if csr is None:
+            csr = to_csr(graph)
+        edge_credit = np.zeros((len(missing), len(csr.edges)))
+        for block_credit in _map_chunks(brandes_sweep_csr, csr, missing, None, workers):
+            edge_credit += block_credit
+        for d, row in zip(missing, edge_credit.tolist()):
+            result[d] = {e: c / 2 for e, c in zip(csr.edges, row) if c}
+            if cache is not None:
+                cache.put(('betweenness', key, d), result[d], _approx_bytes(result[d]))
+
+    return {d: dict(result[d]) for d in depths}
+
+
+def approximate_betweenness(graph, max_depth, csr=None, workers=None, cache=None):
     """
     Compute the approximate betweenness of each edge, using max_depth to reduce
     computation time in breadth-first search.
-    You should call the bfs and bottom_up functions defined above for each node
-    in the graph, and sum together the results. Be sure to divide by 2 at the
-    end to get the final betweenness.
+    This sums, over every node in the graph, the credit bottom_up assigns
+    after a bfs from that node, and divides by 2 at the end to get the final
+    betweenness. The work is done by brandes_csr on a CSR copy of the graph;
+    pass csr to reuse one built earlier with to_csr. With workers > 1 the
+    roots are split across a process pool; the result is the same as the
+    serial one.
     Params:
       graph.......A networkx Graph
       max_depth...An integer representing the maximum depth to search.
+      csr.........Optional CSRGraph for graph, from to_csr.
+      workers.....Optional number of worker processes.
+      cache.......Optional ByteLRUCache (e.g. bfs_cache) to reuse results,
+                  also filled by sweep_betweenness.
     Returns:
       A dict mapping edges to betweenness. Each key is a tuple of two strings
       representing an edge (e.g., ('A', 'B')). Make sure each of these tuples
@@ -210,20 +692,121 @@ def approximate_betweenness(graph, max_depth):
     """
     ###TODO
     pass
-    result = defaultdict(float)
-    
-    for n in graph.nodes():
-        node2distances, node2num_paths, node2parents = bfs(graph, n, max_depth)
-        edge2score = bottom_up(n, node2distances, node2num_paths, node2parents)
-      
-        for a,b in edge2score.items():
-            result[a] += b/2
-   
+    if cache is not None:
+        key = ('betweenness', graph_key(graph), max_depth)
+        result = cache.get(key)
+        if result is not None:
+            return dict(result)
+    if csr is None:
+        csr = to_csr(graph)
+    edge_credit = sum_edge_credit(csr, max_depth, workers=workers)
+    result = {e: c / 2 for e, c in zip(csr.edges, edge_credit.tolist()) if c}
+    if cache is not None:
+        cache.put(key, result, _approx_bytes(result))
+
+    return dict(result)
+
+
+def sampled_betweenness(graph, max_depth, k, seed=None, csr=None, workers=None):
+    """
+    Estimate approximate_betweenness from k randomly chosen pivot roots
+    instead of every node. The summed credit is scaled by n/k, so the
+    estimate is unbiased, and it costs k searches instead of n.
+    Params:
+      graph.......A networkx Graph
+      max_depth...An integer representing the maximum depth to search.
+      k...........Number of pivots, at least 1 (capped at the number of nodes).
+      seed........Seed for choosing the pivots.
+      csr.........Optional CSRGraph for graph, from to_csr.
+      workers.....Optional number of worker processes.
+    Returns:
+      A dict mapping edges to estimated betweenness, keyed as in
+      approximate_betweenness.
+    With every node as a pivot, this is exactly approximate_betweenness:
+    >>> sampled_betweenness(example_graph(), 2, 7, seed=0) == approximate_betweenness(example_graph(), 2)
+    True
+    >>> betweenness = sampled_betweenness(example_graph(), 5, 3, seed=1)
+    >>> max(betweenness, key=betweenness.get)
+    ('B', 'D')
+    >>> sampled_betweenness(nx.Graph(), 2, 3)
+    {}
+    """
+    if k < 1:
+        raise ValueError('k must be at least 1, got %r' % (k,))
+    if csr is None:
+        csr = to_csr(graph)
+    n = len(csr.nodes)
+    if n == 0:
+        return {}
+    k = min(k, n)
+    pivots = sorted(random.Random(seed).sample(range(n), k))
+    edge_credit = sum_edge_credit(csr, max_depth, pivots, workers)
+    scale = n / k
+
+    return {e: c * scale / 2 for e, c in zip(csr.edges, edge_credit.tolist()) if c}
+
+
+def adaptive_betweenness(graph, max_depth, batch=32, top=10, budget=None, seed=None, csr=None):
+    """
+    Estimate approximate_betweenness by adding batches of random pivots
+    until the top edges stop changing or a time budget runs out.
+    Pivots are drawn without replacement from a seeded shuffle of the nodes.
+    After each batch, the `top` highest edges (ties broken by name, as in
+    partition_girvan_newman) are compared with the previous batch; when
+    they are the same, in the same order, the estimate is returned. If
+    every node has been used, the result is exact.
+    Params:
+      graph.......A networkx Graph
+      max_depth...An integer representing the maximum depth to search.
+      batch.......Number of pivots added per round, at least 1.
+      top.........How many of the highest edges must be stable.
+      budget......Optional wall-clock limit in seconds.
+      seed........Seed for the pivot order.
+      csr.........Optional CSRGraph for graph, from to_csr.
+    Returns:
+      betweenness...dict mapping edges to estimated betweenness.
+      num_pivots....the number of pivots used.
+    >>> betweenness, num_pivots = adaptive_betweenness(example_graph(), 5, batch=2, top=1, seed=0)
+    >>> max(betweenness, key=betweenness.get), num_pivots
+    (('B', 'D'), 4)
+    >>> adaptive_betweenness(nx.Graph(), 2)
+    ({}, 0)
+    """
+    if batch < 1:
+        raise ValueError('batch must be at least 1, got %r' % (batch,))
+    start = time.time()
+    if csr is None:
+        csr = to_csr(graph)
+    adjacency, incident = csr_lists(csr)
+    n = len(adjacency)
+    pivots = list(range(n))
+    random.Random(seed).shuffle(pivots)
+
+    edge_credit = [0.] * len(csr.edges)
+    distance = [-1] * n
+    num_paths = [0] * n
+    credit = [0.] * n
+    ranking = None
+    used = 0
+
+    while used < n:
+        for root in pivots[used:used + batch]:
+            root_credit(adjacency, incident, root, max_depth, distance, num_paths, credit, edge_credit)
+        used = min(used + batch, n)
+        ordered = sorted(range(len(edge_credit)), key=lambda e: -edge_credit[e])
+        new_ranking = [e for e in ordered if edge_credit[e]][:top]
+        if new_ranking == ranking:
+            break
+        ranking = new_ranking
+        if budget is not None and time.time() - start >= budget:
+            break
+
+    if used == 0:
+        return {}, 0
+    scale = n / used
+    return {e: c * scale / 2 for e, c in zip(csr.edges, edge_credit) if c}, used
 
-    return dict(sorted(result.items()))
 
-    
-    
 def is_approximation_always_right():
     """
     Look at the doctests for approximate betweenness. In this example, the
@@ -244,7 +827,176 @@ def is_approximation_always_right():
     return "yes"
 
 
-def partition_girvan_newman(graph, max_depth):
+def iterative_girvan_newman(graph, max_depth, csr=None, splits=1):
+    """
+    True Girvan-Newman: repeatedly remove the edge with the highest
+    approximate betweenness, recomputing betweenness after every removal,
+    until a component has split splits times.
+    Each root's edge credit is cached. Removing edge e can only change the
+    shortest-path DAG of a root if e was in that DAG, i.e. if the root gave
+    e credit; those are the only roots searched again, and only the edges
+    whose credit changed are re-summed (in root order, so the totals are the
+    same as a full recompute). Ties are broken by edge name, as in
+    partition_girvan_newman.
+    The next edge comes from a heap of (-betweenness, edge id) entries;
+    entries made stale by a later change are skipped when popped. Whether a
+    removal split its component is found by searching from both endpoints
+    at once, always growing the smaller side, so the cost is bounded by the
+    smaller of the two pieces.
+    Params:
+      graph.......A networkx Graph
+      max_depth...An integer representing the maximum depth to search.
+      csr.........Optional CSRGraph for graph, from to_csr.
+      splits......number of component splits to make before stopping.
+    Returns:
+      The list of removed edges, in removal order; the last one made the
+      final split (or no edges were left to remove).
+    >>> iterative_girvan_newman(example_graph(), 5)
+    [('B', 'D')]
+    >>> g = example_graph()
+    >>> g.add_edges_from([('A', 'E'), ('C', 'G')])
+    >>> iterative_girvan_newman(g, 5)
+    [('A', 'E'), ('B', 'D'), ('C', 'G')]
+    """
+    if csr is None:
+        csr = to_csr(graph)
+    adjacency, incident = csr_lists(csr)
+    n = len(adjacency)
+    distance = [-1] * n
+    num_paths = [0] * n
+    credit = [0.] * n
+
+    root2credit = []
+    edge2roots = [set() for e in csr.edges]
+    for root in range(n):
+        out = defaultdict(float)
+        root_credit(adjacency, incident, root, max_depth, distance, num_paths, credit, out)
+        root2credit.append(out)
+        for eid in out:
+            edge2roots[eid].add(root)
+    total = [sum(root2credit[r][eid] for r in sorted(roots)) for eid, roots in enumerate(edge2roots)]
+
+    alive = [True] * len(csr.edges)
+    heap = [(-t, eid) for eid, t in enumerate(total)]
+    heapq.heapify(heap)
+    removed = []
+    while heap and splits > 0:
+        t, eid = heapq.heappop(heap)
+        if not alive[eid] or -t != total[eid]:
+            continue
+        alive[eid] = False
+        removed.append(csr.edges[eid])
+        u = csr.index[csr.edges[eid][0]]
+        v = csr.index[csr.edges[eid][1]]
+        adjacency[u].remove(v)
+        adjacency[v].remove(u)
+        incident[u].remove((v, eid))
+        incident[v].remove((u, eid))
+
+        touched = set([eid])
+        for root in sorted(edge2roots[eid]):
+            old = root2credit[root]
+            out = defaultdict(float)
+            root_credit(adjacency, incident, root, max_depth, distance, num_paths, credit, out)
+            root2credit[root] = out
+            for e in old:
+                edge2roots[e].discard(root)
+            for e in out:
+                edge2roots[e].add(root)
+            touched.update(old)
+            touched.update(out)
+        for e in touched:
+            if alive[e]:
+                new_total = sum(root2credit[r][e] for r in sorted(edge2roots[e]))
+                if new_total != total[e]:
+                    total[e] = new_total
+                    heapq.heappush(heap, (-new_total, e))
+
+        if not connected(adjacency, u, v):
+            splits -= 1
+
+    return removed
+
+
+def connected(adjacency, u, v):
+    """
+    Whether u and v are in the same component, searching from both at once
+    and always extending the side that has reached fewer nodes. It stops as
+    soon as the two searches meet or one runs out, so a split costs about
+    the size of the smaller piece.
+    >>> connected([[1], [0], [3], [2]], 0, 1), connected([[1], [0], [3], [2]], 0, 2)
+    (True, False)
+    """
+    if u == v:
+        return True
+    sides = [(set([u]), deque([u])), (set([v]), deque([v]))]
+    while sides[0][1] and sides[1][1]:
+        if len(sides[0][0]) > len(sides[1][0]):
+            sides.reverse()
+        seen, visiting = sides[0]
+        other = sides[1][0]
+        c = visiting.popleft()
+        for node in adjacency[c]:
+            if node in other:
+                return True
+            if node not in seen:
+                seen.add(node)
+                visiting.append(node)
+    return False
+
+
+def components_after_removals(graph, removal):
+    """
+    Count the connected components of graph after each prefix of an edge
+    removal sequence, without touching the graph.
+    This runs union-find backwards: start from the graph with every edge in
+    removal gone, then add the removed edges back from last to first. That
+    is one pass over the edges instead of a component search per removal.
+    Params:
+      graph.....A networkx Graph
+      removal...list of edges (tuples of node names) in removal order.
+    Returns:
+      A list of len(removal) + 1 ints; entry t is the number of connected
+      components once the first t edges of removal are removed.
+    >>> components_after_removals(example_graph(), [('B', 'D'), ('A', 'B'), ('A', 'C')])
+    [1, 2, 2, 3]
+    """
+    index = {n: i for i, n in enumerate(graph.nodes())}
+    parent = list(range(len(index)))
+    size = [1] * len(index)
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(a, b):
+        a = find(a)
+        b = find(b)
+        if a == b:
+            return 0
+        if size[a] < size[b]:
+            a, b = b, a
+        parent[b] = a
+        size[a] += size[b]
+        return 1
+
+    removed = set(frozenset(e) for e in removal)
+    count = len(index)
+    for a, b in graph.edges():
+        if frozenset((a, b)) not in removed:
+            count -= union(index[a], index[b])
+
+    counts = [count]
+    for a, b in reversed(removal):
+        count -= union(index[a], index[b])
+        counts.append(count)
+
+    return counts[::-1]
+
+
+def partition_girvan_newman(graph, max_depth, workers=None, iterative=False, cache=None):
     """
     Use your approximate_betweenness implementation to partition a graph.
     Unlike in class, here you will not implement this recursively. Instead,
@@ -261,6 +1013,10 @@ def partition_girvan_newman(graph, max_depth):
     Params:
       graph.......A networkx Graph
       max_depth...An integer representing the maximum depth to search.
+      workers.....Optional number of processes for approximate_betweenness.
+      iterative...If True, recompute betweenness after every removal
+                  (see iterative_girvan_newman) instead of computing it once.
+      cache.......Optional ByteLRUCache for approximate_betweenness.
     Returns:
       A list of networkx Graph objects, one per partition.
     >>> components = partition_girvan_newman(example_graph(), 5)
@@ -269,32 +1025,116 @@ def partition_girvan_newman(graph, max_depth):
     ['A', 'B', 'C']
     >>> sorted(components[1].nodes())
     ['D', 'E', 'F', 'G']
+    >>> components = partition_girvan_newman(example_graph(), 5, iterative=True)
+    >>> sorted(sorted(c.nodes()) for c in components)
+    [['A', 'B', 'C'], ['D', 'E', 'F', 'G']]
     """
     ###TODO
     pass
-    
+
+    if iterative:
+        graph_copy = graph.copy()
+        graph_copy.remove_edges_from(iterative_girvan_newman(graph, max_depth))
+        return [c for c in nx.connected_component_subgraphs(graph_copy)]
+
+    ab = approximate_betweenness(graph, max_depth, workers=workers, cache=cache)
+    return split_by_betweenness(graph, ab)
+
+
+def split_by_betweenness(graph, betweenness):
+    """
+    The edge removal step of partition_girvan_newman: remove edges in
+    decreasing order of betweenness (ties broken by edge name) from a copy of
+    graph until it splits, and return the components.
+    Params:
+      graph.........A networkx Graph
+      betweenness...A dict from edges to betweenness, as returned by
+                    approximate_betweenness.
+    Returns:
+      A list of networkx Graph objects, one per partition, or None if graph
+      was not connected to begin with.
+    """
     graph_copy = graph.copy()
-    ab = approximate_betweenness(graph, max_depth)
-    
-    sorted_dict = sorted(ab.items(), key = lambda x: (-x[1],x[0]))
-    components = [c for c in nx.connected_component_subgraphs(graph)]
-    edge=[]
-    if (len(components) == 1):
-        for i in sorted_dict:
-            graph_copy.remove_edge(*i[0])
-            components = [c for c in  nx.connected_component_subgraphs(graph_copy)]
-            if len(components) < 1:
-                break
-            elif len(components) > 1:
-                return components
+    sorted_dict = sorted(betweenness.items(), key = lambda x: (-x[1],x[0]))
+    removal = [e for e, b in sorted_dict]
+    counts = components_after_removals(graph, removal)
+    if (counts[0] == 1):
+        for t in range(1, len(counts)):
+            if counts[t] > 1:
+                graph_copy.remove_edges_from(removal[:t])
+                return [c for c in nx.connected_component_subgraphs(graph_copy)]
+
 
-def get_subgraph(graph, min_degree):
+def core_numbers(graph):
+    """
+    Compute the core number of every node: the largest k such that the node
+    is in the k-core, the maximal subgraph in which every node has degree
+    at least k. This is the O(V+E) bucket-queue algorithm of Batagelj and
+    Zaversnik: nodes are kept in an array sorted by current degree, with
+    the start of each degree's bucket, and peeling a node moves each of its
+    higher-degree neighbors down one bucket in O(1).
+    Params:
+      graph...a networkx graph
+    Returns:
+      A dict from each node to its core number.
+    >>> sorted(core_numbers(example_graph()).items())
+    [('A', 2), ('B', 2), ('C', 2), ('D', 2), ('E', 2), ('F', 2), ('G', 2)]
+    """
+    nodes = graph.nodes()
+    index = {n: i for i, n in enumerate(nodes)}
+    neighbors = [[index[m] for m in graph.neighbors(n) if m != n] for n in nodes]
+    degree = [len(nbrs) for nbrs in neighbors]
+    max_degree = max(degree) if degree else 0
+
+    # bucket[d] is where nodes of degree d start in vert.
+    bucket = [0] * (max_degree + 1)
+    for d in degree:
+        bucket[d] += 1
+    start = 0
+    for d in range(max_degree + 1):
+        bucket[d], start = start, start + bucket[d]
+    pos = [0] * len(nodes)
+    vert = [0] * len(nodes)
+    for v, d in enumerate(degree):
+        pos[v] = bucket[d]
+        vert[pos[v]] = v
+        bucket[d] += 1
+    for d in range(max_degree, 0, -1):
+        bucket[d] = bucket[d - 1]
+    if bucket:
+        bucket[0] = 0
+
+    for i in range(len(nodes)):
+        v = vert[i]
+        for u in neighbors[v]:
+            if degree[u] > degree[v]:
+                du = degree[u]
+                pu = pos[u]
+                pw = bucket[du]
+                w = vert[pw]
+                if u != w:
+                    pos[u], vert[pu] = pw, w
+                    pos[w], vert[pw] = pu, u
+                bucket[du] += 1
+                degree[u] -= 1
+
+    return {n: degree[i] for i, n in enumerate(nodes)}
+
+
+def get_subgraph(graph, min_degree, core=False, cores=None):
     """Return a subgraph containing nodes whose degree is
     greater than or equal to min_degree.
     We'll use this in the main method to prune the original graph.
+    With core=True, return the min_degree-core instead: nodes are pruned
+    until every remaining node has min_degree neighbors left, which a
+    single degree filter does not guarantee. This is a mask over
+    core_numbers, which is O(V+E); pass cores=core_numbers(graph) to
+    try several thresholds without recomputing it.
     Params:
       graph........a networkx graph
       min_degree...degree threshold
+      core.........if True, return the k-core for k=min_degree
+      cores........optional core_numbers(graph), to reuse across thresholds
     Returns:
       a networkx graph, filtered as defined above.
     >>> subgraph = get_subgraph(example_graph(), 3)
@@ -302,10 +1142,21 @@ def get_subgraph(graph, min_degree):
     ['B', 'D', 'F']
     >>> len(subgraph.edges())
     2
+    >>> len(get_subgraph(example_graph(), 3, core=True))
+    0
+    >>> g = example_graph()
+    >>> cores = core_numbers(g)
+    >>> [len(get_subgraph(g, k, core=True, cores=cores)) for k in (1, 2, 3)]
+    [7, 7, 0]
     """
     ###TODO
     pass
-    
+
+    if core:
+        if cores is None:
+            cores = core_numbers(graph)
+        return graph.subgraph([n for n in graph.nodes() if cores[n] >= min_degree])
+
     subgraph = graph.subgraph(graph.nodes())
     degree = subgraph.degree()
     final = [n for n in degree if degree[n] >= min_degree]
@@ -352,6 +1203,8 @@ def cut(S, T, graph):
     ###TODO
     pass
     cut = 0
+    S = set(S)
+    T = set(T)
     edge = [e for e in graph.edges_iter()]
     for e in edge:
         if e[0] in S and e[1] in T:
@@ -382,7 +1235,93 @@ def norm_cut(S, T, graph):
 
 
 
-def score_max_depths(graph, max_depths):
+def edge_arrays(csr):
+    """
+    Return two int arrays (u, v) holding the endpoint ids of every undirected
+    edge of a CSRGraph once, with u < v.
+    >>> u, v = edge_arrays(to_csr(example_graph()))
+    >>> len(u), bool((u < v).all())
+    (9, True)
+    """
+    u = np.repeat(np.arange(len(csr.nodes), dtype=np.int32), np.diff(csr.offsets))
+    keep = u < csr.neighbors
+    return u[keep], csr.neighbors[keep]
+
+
+def partition_labels(graph, clusters, csr=None):
+    """
+    Turn a list of clusters (node lists or graphs) into an int array with
+    the cluster number of each node, in the node order of to_csr(graph).
+    Nodes in no cluster get -1.
+    >>> partition_labels(example_graph(), [['A', 'B', 'C'], ['D', 'E', 'F', 'G']]).tolist()
+    [0, 0, 0, 1, 1, 1, 1]
+    """
+    if csr is None:
+        csr = to_csr(graph)
+    labels = np.full(len(csr.nodes), -1, dtype=np.int32)
+    for i, cluster in enumerate(clusters):
+        for n in cluster:
+            labels[csr.index[n]] = i
+    return labels
+
+
+def partition_scores(graph, labels, csr=None):
+    """
+    Score one or many partitions of a graph in a single pass over its edges.
+    For every cluster c this computes the volume (edges with at least one
+    end in c, as in volume) and the cut (edges with exactly one end in c).
+    The normalized cut of a partition is the sum over clusters of
+    cut/volume, which for two clusters S, T is norm_cut(S, T, graph).
+    Nodes labelled -1 belong to no cluster.
+    Params:
+      graph....a networkx graph
+      labels...int array of cluster labels per node (see partition_labels),
+               or a 2-d array with one row per candidate partition.
+      csr......Optional CSRGraph for graph, from to_csr.
+    Returns:
+      volumes....array (partitions x clusters) of cluster volumes
+      cuts.......array (partitions x clusters) of cluster cut sizes
+      norm_cuts..array with the normalized cut of each partition
+      For 1-d labels, the leading partition axis is dropped.
+    >>> labels = partition_labels(example_graph(), [['A', 'B', 'C'], ['D', 'E', 'F', 'G']])
+    >>> volumes, cuts, norm_cuts = partition_scores(example_graph(), labels)
+    >>> volumes.tolist(), cuts.tolist(), float(norm_cuts)
+    ([4, 6], [1, 1], 0.41666666666666663)
+    >>> float(norm_cuts) == norm_cut(['A', 'B', 'C'], ['D', 'E', 'F', 'G'], example_graph())
+    True
+    """
+    if csr is None:
+        csr = to_csr(graph)
+    labels = np.asarray(labels, dtype=np.int64)
+    single = labels.ndim == 1
+    labels = np.atleast_2d(labels)
+    num_partitions = labels.shape[0]
+    k = int(labels.max()) + 1 if labels.size else 0
+    u, v = edge_arrays(csr)
+
+    lu = labels[:, u]
+    lv = labels[:, v]
+    rows = np.arange(num_partitions)[:, None] * k
+    same = lu == lv
+    size = num_partitions * k
+
+    def count(keys, mask):
+        return np.bincount((keys + rows)[mask & (keys >= 0)], minlength=size)
+
+    internal = count(lu, same)
+    cuts = count(lu, ~same) + count(lv, ~same)
+    volumes = (internal + cuts).reshape(num_partitions, k)
+    cuts = cuts.reshape(num_partitions, k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(volumes > 0, cuts / volumes, 0.)
+    norm_cuts = ratios.sum(axis=1)
+
+    if single:
+        return volumes[0], cuts[0], norm_cuts[0]
+    return volumes, cuts, norm_cuts
+
+
+def score_max_depths(graph, max_depths, sweep=True, cache=None):
     """
     In order to assess the quality of the approximate partitioning method
     we've developed, we will run it with different values for max_depth
@@ -392,6 +1331,10 @@ def score_max_depths(graph, max_depths):
       graph........a networkx Graph
       max_depths...a list of ints for the max_depth values to be passed
                    to calls to partition_girvan_newman
+      sweep........if True, get the betweenness for every depth from one
+                   search per root (sweep_betweenness) instead of one
+                   partition_girvan_newman call per depth.
+      cache........Optional ByteLRUCache for the betweenness of each depth.
     Returns:
       A list of (int, float) tuples representing the max_depth and the
       norm_cut value obtained by the partitions returned by
@@ -400,14 +1343,19 @@ def score_max_depths(graph, max_depths):
     ###TODO
     pass
 
-    score = []
-    graph_copy = graph.copy()
+    csr = to_csr(graph)
+    if sweep:
+        betweenness = sweep_betweenness(graph, max_depths, csr, cache=cache)
+    labels = []
     for depth in max_depths:
-        component = partition_girvan_newman(graph, depth)
-        normcut_g = norm_cut(component[0].nodes(), component[1].nodes(), graph)
+        if sweep:
+            component = split_by_betweenness(graph, betweenness[depth])
+        else:
+            component = partition_girvan_newman(graph, depth, cache=cache)
+        labels.append(partition_labels(graph, component[:2], csr))
+    _, _, norm_cuts = partition_scores(graph, labels, csr)
 
-        score.append((depth,normcut_g))
-    return score
+    return [(depth, float(normcut_g)) for depth, normcut_g in zip(max_depths, norm_cuts)]
 
 ## Link prediction
 
@@ -415,7 +1363,57 @@ def score_max_depths(graph, max_depths):
 # we will remove 5 of the accounts that Bill Gates likes and
 # compute our accuracy at recovering those links.
 
-def make_training_graph(graph, test_node, n):
+class HiddenEdgeView(object):
+    """
+    A read-only view of a networkx Graph with some edges hidden, used as a
+    training graph without copying the base graph. It has the parts of
+    the Graph interface that bfs, jaccard, path_score and to_csr use.
+    The base graph is shared, not copied, so it must not change while the
+    view is in use.
+    >>> view = HiddenEdgeView(example_graph(), [('D', 'B'), ('D', 'E')])
+    >>> sorted(view.neighbors('D')), view.has_edge('B', 'D'), view.number_of_edges()
+    (['F', 'G'], False, 7)
+    """
+
+    def __init__(self, graph, hidden_edges):
+        self.graph = graph
+        self.hidden = set(frozenset(e) for e in hidden_edges if graph.has_edge(*e))
+        self.hidden_nodes = set(n for e in self.hidden for n in e)
+
+    def nodes(self):
+        return self.graph.nodes()
+
+    def neighbors(self, n):
+        if n not in self.hidden_nodes:
+            return self.graph.neighbors(n)
+        return [m for m in self.graph.neighbors(n) if frozenset((n, m)) not in self.hidden]
+
+    def has_edge(self, u, v):
+        return self.graph.has_edge(u, v) and frozenset((u, v)) not in self.hidden
+
+    def degree(self, n):
+        return len(self.neighbors(n))
+
+    def edges(self):
+        return [e for e in self.graph.edges() if frozenset(e) not in self.hidden]
+
+    def order(self):
+        return self.graph.order()
+
+    def number_of_edges(self):
+        return self.graph.number_of_edges() - len(self.hidden)
+
+    def __len__(self):
+        return len(self.graph)
+
+    def __iter__(self):
+        return iter(self.graph)
+
+    def __contains__(self, n):
+        return n in self.graph
+
+
+def make_training_graph(graph, test_node, n, view=False):
     """
     To make a training graph, we need to remove n edges from the graph.
     As in lecture, we'll assume there is a test_node for which we will
@@ -429,6 +1427,8 @@ def make_training_graph(graph, test_node, n):
       test_node...a string representing one node in the graph whose
                   edges will be removed.
       n...........the number of edges to remove.
+      view........if True, return a HiddenEdgeView of graph instead of
+                  a copy, so memory does not grow with each test node.
     Returns:
       A *new* networkx Graph with n edges removed.
     In this doctest, we remove edges for two friends of D:
@@ -438,11 +1438,16 @@ def make_training_graph(graph, test_node, n):
     >>> train_graph = make_training_graph(g, 'D', 2)
     >>> sorted(train_graph.neighbors('D'))
     ['F', 'G']
+    >>> jaccard(make_training_graph(g, 'D', 2, view=True), 'D', 2) == jaccard(train_graph, 'D', 2)
+    True
     """
     ###TODO
     pass
-    tgraph = graph.copy()
     neighbors = sorted(graph.neighbors(test_node))
+    if view:
+        return HiddenEdgeView(graph, [(test_node, m) for m in neighbors[:n]])
+
+    tgraph = graph.copy()
     for i in range(n):
         tgraph.remove_edge(test_node, neighbors[i])
 
@@ -487,6 +1492,106 @@ def jaccard(graph, node, k):
     return score2[:k]
 
 
+def adjacency_matrix(csr):
+    """
+    The 0/1 scipy csr_matrix adjacency matrix of a CSRGraph, rows and
+    columns in node id order.
+    """
+    n = len(csr.nodes)
+    return csr_matrix((np.ones(len(csr.neighbors), dtype=np.int32), csr.neighbors, csr.offsets), shape=(n, n))
+
+
+def alphabetical_rank(csr):
+    """
+    Return an int array giving the position of each node id in the
+    alphabetical order of node names, used to break ties like sorted() does.
+    """
+    order = sorted(range(len(csr.nodes)), key=lambda i: csr.nodes[i])
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank, order
+
+
+def top_k(ids, scores, rank, k):
+    """
+    The k best ids by descending score, ties broken by alphabetical rank.
+    Only the ids scoring at least the k-th best score are sorted.
+    >>> top_k(np.array([0, 1]), np.array([.5, .25]), np.array([0, 1]), 0)
+    (array([], dtype=int64), array([], dtype=float64))
+    """
+    if k <= 0:
+        return ids[:0], scores[:0]
+    if len(scores) > k:
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = scores >= threshold
+        ids = ids[keep]
+        scores = scores[keep]
+    best = np.lexsort((rank[ids], -scores))[:k]
+    return ids[best], scores[best]
+
+
+def jaccard_batch(graph, nodes, k, csr=None, block=1024):
+    """
+    jaccard for many nodes at once.
+    Intersection sizes come from the sparse product A.A (A is symmetric, so
+    this is A.A^T) restricted to the query rows, which only has entries for
+    nodes two hops away; union sizes are deg(x) + deg(y) - intersection.
+    Each row keeps its top k with a partial selection. Nodes with no
+    common neighbors all score 0, so if a row has fewer than k candidates
+    the rest are filled with the alphabetically first remaining nodes, as
+    jaccard does. Rows are computed block rows at a time to bound memory.
+    Params:
+      graph....a networkx graph
+      nodes....the nodes to recommend links for (None for every node).
+      k........the number of links to recommend per node.
+      csr......Optional CSRGraph for graph, from to_csr.
+      block....number of query rows per sparse product.
+    Returns:
+      A dict from each node to the list jaccard(graph, node, k) returns.
+    >>> g = example_graph()
+    >>> train_graph = make_training_graph(g, 'D', 2)
+    >>> jaccard_batch(train_graph, ['D', 'A'], 2)
+    {'D': [(('D', 'E'), 0.5), (('D', 'A'), 0.0)], 'A': [(('A', 'D'), 0.0), (('A', 'E'), 0.0)]}
+    >>> all(jaccard_batch(g, None, 3)[n] == jaccard(g, n, 3) for n in g.nodes())
+    True
+    """
+    if csr is None:
+        csr = to_csr(graph)
+    if nodes is None:
+        nodes = csr.nodes
+    A = adjacency_matrix(csr)
+    degree = np.diff(csr.offsets)
+    rank, order = alphabetical_rank(csr)
+    result = {}
+
+    for b in range(0, len(nodes), block):
+        rows = [csr.index[x] for x in nodes[b:b + block]]
+        common = A[rows].dot(A).tocsr()
+        for r, x in enumerate(rows):
+            cols = common.indices[common.indptr[r]:common.indptr[r + 1]]
+            inter = common.data[common.indptr[r]:common.indptr[r + 1]]
+            neighbors = csr.neighbors[csr.offsets[x]:csr.offsets[x + 1]]
+            keep = (cols != x) & ~np.isin(cols, neighbors)
+            cols = cols[keep]
+            inter = inter[keep]
+            scores = inter / (degree[x] + degree[cols] - inter)
+            ids, scores = top_k(cols, scores, rank, k)
+
+            name = csr.nodes[x]
+            scored = [((name, csr.nodes[i]), float(v)) for i, v in zip(ids.tolist(), scores.tolist())]
+            if len(scored) < k:
+                skip = set(neighbors.tolist()) | set(cols.tolist())
+                skip.add(x)
+                for i in order:
+                    if len(scored) >= k:
+                        break
+                    if i not in skip:
+                        scored.append(((name, csr.nodes[i]), 0.0))
+            result[name] = scored
+
+    return result
+
+
     # One limitation of Jaccard is that it only has non-zero values for nodes two hops away.
     #
     # Implement a new link prediction function that computes the similarity between two nodes $x$ and $y$  as follows:
@@ -501,7 +1606,7 @@ def jaccard(graph, node, k):
     # - $n_{x,y,i}$ is the number of shortest paths between $x$ and $y$ with length $i$
 
 
-def path_score(graph, root, k, beta):
+def path_score(graph, root, k, beta, cache=None, key=None):
     """
     Compute a new link prediction scoring function based on the shortest
     paths between two nodes, as defined above.
@@ -512,6 +1617,8 @@ def path_score(graph, root, k, beta):
       root.....a node in the graph (a string) to recommend links for.
       k........the number of links to recommend.
       beta.....the beta parameter in the equation above.
+      cache....optional ByteLRUCache for the search (see cached_bfs)
+      key......optional precomputed graph_key(graph) for the cache
     Returns:
       A list of tuples in descending order of score. Ties are broken by
       alphabetical order of the terminal node in the edge.
@@ -529,23 +1636,152 @@ def path_score(graph, root, k, beta):
     pass
 
 
+    node2distances, node2num_paths, node2parents = cached_bfs(graph, root, 5, cache, key)
+    neighbors = set(graph.neighbors(root))
     scores = []
-    graph_nodes = graph.nodes()
-    node2distances, node2num_paths, node2parents = bfs(graph, root, 5)
-    
-    for node in graph_nodes:
-        if(node not in graph.neighbors(root)):
-            score = (beta ** node2distances[node] ) * (node2num_paths[node])
+
+    for node in node2distances:
+        if(node != root and node not in neighbors):
+            score = (beta ** node2distances[node]) * (node2num_paths[node])
             scores.append(((root,node),score))
 
-    sorted_scores = sorted(scores, key=lambda x: (-x[1], x[0][1]))
-    sorted_scores.pop(0)
+    return heapq.nsmallest(k, scores, key=lambda x: (-x[1], x[0][1]))
 
-    return sorted_scores[:k]
 
+def path_score_batch(graph, roots, k, beta, max_depth=5, csr=None, block=256):
+    """
+    path_score for many roots at once.
+    The breadth-first searches of a block of roots run together as sparse
+    matrix products: row r of the frontier holds, for every node first
+    reached at level i from root r, its number of shortest paths n_{r,y,i},
+    and frontier.A, minus the nodes already reached, is the next level. A
+    node's score is beta^i * n_{r,y,i}; levels 0 and 1 are the root and its
+    neighbors, which are not scored. Each row then keeps its top k.
+    Params:
+      graph.......a networkx graph
+      roots.......nodes to recommend links for (None for every node).
+      k...........the number of links to recommend per root.
+      beta........the beta parameter of path_score.
+      max_depth...search depth (path_score uses 5).
+      csr.........Optional CSRGraph for graph, from to_csr.
+      block.......number of roots searched together, to bound memory.
+    Returns:
+      A dict from each root to the list path_score(graph, root, k, beta) returns.
+    >>> train_graph = example_graph()
+    >>> train_graph.remove_edge(*('D', 'F'))
+    >>> path_score_batch(train_graph, ['D', 'A'], k=2, beta=.5)
+    {'D': [(('D', 'F'), 0.5), (('D', 'A'), 0.25)], 'A': [(('A', 'D'), 0.25), (('A', 'E'), 0.125)]}
+    >>> all(path_score_batch(train_graph, None, 4, .1)[n] == path_score(train_graph, n, 4, .1) for n in train_graph.nodes())
+    True
+    """
+    if csr is None:
+        csr = to_csr(graph)
+    if roots is None:
+        roots = csr.nodes
+    n = len(csr.nodes)
+    A = adjacency_matrix(csr).astype(np.int64)
+    rank, order = alphabetical_rank(csr)
+    result = {}
+
+    for b in range(0, len(roots), block):
+        rows = [csr.index[x] for x in roots[b:b + block]]
+        frontier = csr_matrix((np.ones(len(rows), dtype=np.int64), (np.arange(len(rows)), rows)),
+                              shape=(len(rows), n))
+        reached = frontier.copy()
+        scores = csr_matrix((len(rows), n))
+        for depth in range(1, max_depth + 1):
+            frontier = frontier.dot(A)
+            frontier = (frontier - frontier.multiply(reached > 0)).tocsr()
+            frontier.eliminate_zeros()
+            if frontier.nnz == 0:
+                break
+            reached = reached + frontier
+            if depth > 1:
+                scores = scores + frontier.astype(np.float64) * (beta ** depth)
+
+        scores = scores.tocsr()
+        for r, x in enumerate(rows):
+            cols = scores.indices[scores.indptr[r]:scores.indptr[r + 1]]
+            values = scores.data[scores.indptr[r]:scores.indptr[r + 1]]
+            ids, values = top_k(cols, values, rank, k)
+            name = csr.nodes[x]
+            result[name] = [((name, csr.nodes[i]), float(v)) for i, v in zip(ids.tolist(), values.tolist())]
 
+    return result
 
 
+def katz(graph, node, k, beta, max_length=4):
+    """
+    Compute the k highest scoring edges to add to this node with a truncated
+    Katz score: s(x,y) = sum over l=1..max_length of beta^l times the number
+    of walks of length l from x to y. Unlike path_score, every walk counts,
+    not only the shortest ones.
+    Note that we don't return scores for edges that already appear in the graph.
+    Params:
+      graph........a networkx graph
+      node.........a node in the graph (a string) to recommend links for.
+      k............the number of links to recommend.
+      beta.........the weight per walk step, in [0,1].
+      max_length...the longest walk counted.
+    Returns:
+      A list of tuples in descending order of score. Ties are broken by
+      alphabetical order of the terminal node in the edge.
+    >>> g = example_graph()
+    >>> train_graph = g.copy()
+    >>> train_graph.remove_edge(*('D', 'F'))
+    >>> katz(train_graph, 'D', k=2, beta=.5, max_length=3)
+    [(('D', 'F'), 0.5), (('D', 'A'), 0.375)]
+    """
+    return katz_batch(graph, [node], k, beta, max_length)[node]
+
+
+def katz_batch(graph, nodes, k, beta, max_length=4, csr=None, max_bytes=2 ** 28):
+    """
+    katz for many nodes at once.
+    For a block of query nodes, the walk counts of length l are the columns
+    A^l[:, block], each obtained from the previous ones with one sparse
+    matrix by dense block product; their weighted sum is the score block.
+    The block size is chosen so the dense blocks stay under max_bytes.
+    Params:
+      graph........a networkx graph
+      nodes........the nodes to recommend links for (None for every node).
+      k............the number of links to recommend per node.
+      beta.........the weight per walk step.
+      max_length...the longest walk counted.
+      csr..........Optional CSRGraph for graph, from to_csr.
+      max_bytes....memory cap for the dense walk and score blocks.
+    Returns:
+      A dict from each node to the list katz(graph, node, k, beta, max_length) returns.
+    """
+    if csr is None:
+        csr = to_csr(graph)
+    if nodes is None:
+        nodes = csr.nodes
+    n = len(csr.nodes)
+    A = adjacency_matrix(csr).astype(np.float64)
+    rank, order = alphabetical_rank(csr)
+    block = max(1, max_bytes // (3 * 8 * max(n, 1)))
+    result = {}
+
+    for b in range(0, len(nodes), block):
+        cols = [csr.index[x] for x in nodes[b:b + block]]
+        walks = A[:, cols].toarray()
+        scores = beta * walks
+        for length in range(2, max_length + 1):
+            walks = A.dot(walks)
+            scores += (beta ** length) * walks
+
+        for c, x in enumerate(cols):
+            column = scores[:, c]
+            column[x] = 0.
+            column[csr.neighbors[csr.offsets[x]:csr.offsets[x + 1]]] = 0.
+            ids = np.flatnonzero(column > 0)
+            ids, values = top_k(ids, column[ids], rank, k)
+            name = csr.nodes[x]
+            result[name] = [((name, csr.nodes[i]), float(v)) for i, v in zip(ids.tolist(), values.tolist())]
+
+    return result
+
 
 def evaluate(predicted_edges, graph):
     """
@@ -563,24 +1799,106 @@ def evaluate(predicted_edges, graph):
     """
     ###TODO
     pass
-    edge = sorted(graph.edges_iter(), key=lambda x: x[1], reverse=False)
+    # The adjacency dict is already a hash of every edge in both directions.
     count = 0
-    for e in edge:
-        for p in predicted_edges:
-            if sorted(p) == sorted(e):
-                count = count + 1
-                    
+    for p in predicted_edges:
+        if graph.has_edge(*p):
+            count = count + 1
+
     return count/len(predicted_edges)
 
 
+_link_state = {}
+
+
+def _init_link_worker(graph, methods, num_removed, k):
+    """
+    Pool initializer: keep the graph and scoring functions in the worker.
+    """
+    _link_state['graph'] = graph
+    _link_state['methods'] = methods
+    _link_state['num_removed'] = num_removed
+    _link_state['k'] = k
+
+
+def _link_worker_query(test_node):
+    """
+    Pool task: _link_query with the worker's graph and methods.
+    """
+    return _link_query(_link_state['graph'], _link_state['methods'], _link_state['num_removed'],
+                       _link_state['k'], test_node)
+
+
+def _link_query(graph, methods, num_removed, k, test_node):
+    """
+    Hide num_removed edges of test_node, run every method on the training
+    graph, and return (method, precision@k, seconds) tuples.
+    """
+    train_graph = make_training_graph(graph, test_node, num_removed, view=True)
+    rows = []
+    for name, method in methods:
+        start = time.time()
+        scores = method(train_graph, test_node, k)
+        elapsed = time.time() - start
+        hits = sum(1 for x in scores if graph.has_edge(*x[0]))
+        rows.append((name, hits / k, elapsed))
+    return rows
+
+
+def evaluate_link_prediction(graph, num_queries, methods=None, num_removed=5, k=5, seed=0, workers=None):
+    """
+    Evaluate link prediction methods on many test nodes.
+    num_queries test nodes with more than num_removed neighbors are chosen
+    at random (seeded). For each, make_training_graph hides its first
+    num_removed edges and every method recommends k links for it, which are
+    checked against graph. Queries run in a process pool when workers > 1.
+    Params:
+      graph.........a networkx Graph
+      num_queries...number of test nodes.
+      methods.......list of (name, function) pairs; each function is called
+                    as function(train_graph, test_node, k), like jaccard.
+                    Default: jaccard and path_score with beta=.1.
+      num_removed...edges hidden per test node.
+      k.............links recommended per test node.
+      seed..........seed for choosing test nodes.
+      workers.......Optional number of worker processes.
+    Returns:
+      A dict from method name to a dict with 'precision' (mean precision@k),
+      'mean_latency' and 'max_latency' (seconds per query) and 'queries'.
+    >>> report = evaluate_link_prediction(example_graph(), 2, num_removed=1, k=2)
+    >>> sorted(report), report['jaccard']['queries']
+    (['jaccard', 'path_score'], 2)
+    """
+    if methods is None:
+        methods = [('jaccard', jaccard), ('path_score', partial(path_score, beta=.1))]
+    candidates = sorted(n for n in graph.nodes() if graph.degree(n) > num_removed)
+    test_nodes = random.Random(seed).sample(candidates, min(num_queries, len(candidates)))
+
+    if workers is None or workers <= 1:
+        results = [_link_query(graph, methods, num_removed, k, n) for n in test_nodes]
+    else:
+        with Pool(workers, initializer=_init_link_worker, initargs=(graph, methods, num_removed, k)) as pool:
+            results = pool.map(_link_worker_query, test_nodes)
+
+    report = {}
+    for name, method in methods:
+        rows = [row for query in results for row in query if row[0] == name]
+        latencies = [row[2] for row in rows]
+        report[name] = {'precision': sum(row[1] for row in rows) / max(len(rows), 1),
+                        'mean_latency': sum(latencies) / max(len(rows), 1),
+                        'max_latency': max(latencies) if latencies else 0.,
+                        'queries': len(rows)}
+    return report
+
+
 """
 Next, we'll download a real dataset to see how our algorithm performs.
 """
-def download_data():
+def download_data(path='edges.txt.gz'):
     """
-    Download the data. Done for you.
+    Download the data to path. Done for you.
     """
-    urllib.request.urlretrieve('http://cs.iit.edu/~culotta/cs579/a1/edges.txt.gz', 'edges.txt.gz')
+    urllib.request.urlretrieve('http://cs.iit.edu/~culotta/cs579/a1/edges.txt.gz', path)
 
 
 def read_graph():
@@ -592,20 +1910,172 @@ def read_graph():
     return nx.read_edgelist('edges.txt.gz', delimiter='\t')
 
 
+def file_checksum(path):
+    """
+    SHA-1 hex digest of a file, read in 1MB blocks.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_graph_cache(path, cache_dir):
+    """
+    Stream a gzipped tab-separated edge list once and write a binary cache
+    of it to cache_dir:
+      nodes.json.....node names; a node's id is its position here.
+      pairs.npy......the distinct edges as int32 id pairs, in file order.
+      offsets.npy, neighbors.npy, edge_ids.npy, edges.npy...the arrays of
+                     to_csr(read_graph()).
+      source.sha1....checksum of path, written last.
+    Node ids follow first appearance in the file and neighbor lists follow
+    edge order, which is how nx.read_edgelist builds the graph, so the cache
+    holds exactly the CSRGraph that to_csr would build from read_graph.
+    """
+    index = {}
+    nodes = []
+    seen = set()
+    pairs = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            p = line.find('#')
+            if p >= 0:
+                line = line[:p]
+            fields = line.strip().split('\t')
+            if len(fields) < 2:
+                continue
+            ids = []
+            for name in fields[:2]:
+                if name not in index:
+                    index[name] = len(nodes)
+                    nodes.append(name)
+                ids.append(index[name])
+            key = (min(ids), max(ids))
+            if key not in seen:
+                seen.add(key)
+                pairs.append(ids)
+    pairs = np.array(pairs, dtype=np.int32).reshape(-1, 2)
+
+    # Each pair gives a slot at both ends (one for a self-loop); a stable
+    # sort by source keeps every neighbor list in file order.
+    pair_of_slot = np.repeat(np.arange(len(pairs)), 2)
+    sources = pairs.ravel()
+    targets = pairs[:, ::-1].ravel()
+    keep = (sources != targets) | (np.arange(len(sources)) % 2 == 0)
+    sources, targets, pair_of_slot = sources[keep], targets[keep], pair_of_slot[keep]
+    order = np.argsort(sources, kind='stable')
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(sources, minlength=len(nodes)))
+    neighbors = targets[order].astype(np.int32)
+
+    named = [(nodes[a], nodes[b]) if nodes[a] < nodes[b] else (nodes[b], nodes[a]) for a, b in pairs.tolist()]
+    edge_order = sorted(range(len(named)), key=lambda i: named[i])
+    pair_rank = np.empty(len(named), dtype=np.int32)
+    pair_rank[edge_order] = np.arange(len(named), dtype=np.int32)
+    edge_ids = pair_rank[pair_of_slot[order]]
+    edges = np.array([[index[a], index[b]] for a, b in (named[i] for i in edge_order)],
+                     dtype=np.int32).reshape(-1, 2)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    checksum_path = os.path.join(cache_dir, 'source.sha1')
+    if os.path.exists(checksum_path):
+        os.remove(checksum_path)
+    with open(os.path.join(cache_dir, 'nodes.json'), 'w') as f:
+        json.dump(nodes, f)
+    for name, array in [('pairs', pairs), ('offsets', offsets), ('neighbors', neighbors),
+                        ('edge_ids', edge_ids), ('edges', edges)]:
+        np.save(os.path.join(cache_dir, name + '.npy'), array)
+    with open(checksum_path, 'w') as f:
+        f.write(file_checksum(path))
+
+
+def load_graph_cache(cache_dir):
+    """
+    Open a cache written by build_graph_cache, memory-mapping its arrays.
+    Returns:
+      csr.....the CSRGraph.
+      pairs...int32 array of edges as id pairs, in file order.
+    """
+    with open(os.path.join(cache_dir, 'nodes.json')) as f:
+        nodes = json.load(f)
+    arrays = {name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+              for name in ['pairs', 'offsets', 'neighbors', 'edge_ids', 'edges']}
+    index = {n: i for i, n in enumerate(nodes)}
+    edges = [(nodes[a], nodes[b]) for a, b in arrays['edges'].tolist()]
+    csr = CSRGraph(nodes, index, arrays['offsets'], arrays['neighbors'], edges, arrays['edge_ids'])
+    return csr, arrays['pairs']
+
+
+def read_graph_cached(path='edges.txt.gz', cache_dir=None):
+    """
+    read_graph backed by a binary cache (see build_graph_cache).
+    The data is downloaded only if neither the file nor a cache exists. If
+    the file is present and its checksum differs from the one the cache was
+    built from, the cache is rebuilt from the text; otherwise the cache is
+    memory-mapped and the text is not parsed.
+    Params:
+      path........the gzipped edge list.
+      cache_dir...where the cache lives (default: path + '.cache').
+    Returns:
+      graph...the networkx undirected graph read_graph would return.
+      csr.....its CSRGraph, on memory-mapped arrays.
+
+    >>> import shutil, tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> path = os.path.join(tmp, 'edges.txt.gz')
+    >>> with gzip.open(path, 'wt') as f:
+    ...     _ = f.write('a\\tb\\nb\\tc\\n')
+    >>> graph, csr = read_graph_cached(path)
+    >>> sorted(graph.edges())
+    [('a', 'b'), ('b', 'c')]
+    >>> checksum_path = os.path.join(path + '.cache', 'source.sha1')
+    >>> built = os.stat(checksum_path).st_mtime_ns
+    >>> graph, csr = read_graph_cached(path)
+    >>> os.stat(checksum_path).st_mtime_ns == built, isinstance(csr.neighbors, np.memmap)
+    (True, True)
+    >>> with gzip.open(path, 'wt') as f:
+    ...     _ = f.write('a\\tb\\nb\\tc\\nc\\td\\n')
+    >>> graph, csr = read_graph_cached(path)
+    >>> sorted(graph.edges()), csr.nodes
+    ([('a', 'b'), ('b', 'c'), ('c', 'd')], ['a', 'b', 'c', 'd'])
+    >>> shutil.rmtree(tmp)
+    """
+    if cache_dir is None:
+        cache_dir = path + '.cache'
+    checksum_path = os.path.join(cache_dir, 'source.sha1')
+    if not os.path.exists(path) and not os.path.exists(checksum_path):
+        download_data(path)
+
+    stale = not os.path.exists(checksum_path)
+    if not stale and os.path.exists(path):
+        with open(checksum_path) as f:
+            stale = f.read().strip() != file_checksum(path)
+    if stale:
+        build_graph_cache(path, cache_dir)
+
+    csr, pairs = load_graph_cache(cache_dir)
+    graph = nx.Graph()
+    graph.add_nodes_from(csr.nodes)
+    graph.add_edges_from((csr.nodes[a], csr.nodes[b]) for a, b in pairs.tolist())
+    return graph, csr
+
+
 def main():
     """
     FYI: This takes ~10-15 seconds to run on my laptop.
     """
-    download_data()
-    graph = read_graph()
+    graph = read_graph_cached()[0]
     print('graph has %d nodes and %d edges' %
           (graph.order(), graph.number_of_edges()))
     subgraph = get_subgraph(graph, 2)
     print('subgraph has %d nodes and %d edges' %
           (subgraph.order(), subgraph.number_of_edges()))
     print('norm_cut scores by max_depth:')
-    print(score_max_depths(subgraph, range(1,5)))
-    clusters = partition_girvan_newman(subgraph, 3)
+    print(score_max_depths(subgraph, range(1,5), cache=bfs_cache))
+    clusters = partition_girvan_newman(subgraph, 3, cache=bfs_cache)
     print('first partition: cluster 1 has %d nodes and cluster 2 has %d nodes' %
           (clusters[0].order(), clusters[1].order()))
     print('cluster 2 nodes:')
@@ -629,6 +2099,13 @@ def main():
     print('path accuracy for beta .1=%g' %
           evaluate([x[0] for x in path_scores], subgraph))
 
+    katz_scores = katz(train_graph, test_node, k=5, beta=.1)
+    print('\ntop katz scores for Bill Gates for beta=.1:')
+    print(katz_scores)
+    print('katz accuracy for beta .1=%g' %
+          evaluate([x[0] for x in katz_scores], subgraph))
+    print('\nsearch cache: %s' % str(bfs_cache.info()))
+
 
 if __name__ == '__main__':
     main()
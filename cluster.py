@@ -9,11 +9,18 @@ Cluster users into communities.
 
 from collections import Counter, defaultdict, deque
 import matplotlib.pyplot as plt
+import hashlib
 import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
 import sys
 import pickle
 import math
-from itertools import chain, combinations
+import os
+import time
+from itertools import chain, combinations, compress
+from multiprocessing import Pool
+from CommunityDetection import bfs, bottom_up, core_numbers, iterative_girvan_newman
 
 
 def get_user_info(name):
@@ -64,7 +71,7 @@ def count_friends(users):
     return upd
 
 
-def create_graph(users, friend_counts, min_common):
+def create_graph(users, friend_counts, min_common, draw=False):
     """
     Create a networkx undirected Graph, adding each user and their friends
     as a node.
@@ -76,68 +83,185 @@ def create_graph(users, friend_counts, min_common):
       users...........The list of user dicts.
       friend_counts...The Counter dict mapping each friend to the number of candidates that follow them.
       min_common......Add friends to the graph if they are followed by more than min_common users.
+      draw............also draw the graph with nx.draw_networkx
     Returns:
       A networkx Graph
     """
 
-    follow = [x for x in friend_counts if friend_counts[x] > min_common]
-    
+    friends = list(friend_counts)
+    counts = np.fromiter(friend_counts.values(), dtype=np.int64, count=len(friends))
+    follow = list(compress(friends, counts > min_common))
+    follow_set = set(follow)
+
     graph = nx.Graph()
-    for x in follow:
-        graph.add_node(x)
+    graph.add_nodes_from(follow)
     #add users nodes
-    for user in users:
-        graph.add_node(user['id'])
-        #list of friends should be plotted
-        fndlst = set(user['friends_id']) & set(follow)
-        #add edges for each node
-        for fnd in fndlst:
-            graph.add_edge(fnd, user['id'])
-
-    nx.draw_networkx(graph, with_labels=True)
-    
+    graph.add_nodes_from(user['id'] for user in users)
+    #one edge per user and followed friend
+    graph.add_edges_from((fnd, user['id']) for user in users for fnd in user['friends_id'] if fnd in follow_set)
+
+    if draw:
+        nx.draw_networkx(graph, with_labels=True)
+
     return graph
 
 
-def draw_network(graph, users, filename):
+# Above this many nodes the spring layout (O(V^2) per iteration) gives way
+# to the spectral layout, and draw_network draws communities instead of nodes.
+SPRING_LAYOUT_LIMIT = 1000
+DRAW_NODE_LIMIT = 3000
+
+
+def layout_key(graph):
+    """
+    A file name for the layout of graph, from a hash of its sorted node set.
+    """
+
+    digest = hashlib.sha1()
+    for n in sorted(str(n) for n in graph.nodes()):
+        digest.update(n.encode('utf-8'))
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def cached_layout(graph, pos=None, cache_dir='layouts'):
+    """
+    Node positions for graph. Nodes already in pos keep their positions;
+    when every node is covered no layout is computed at all. Otherwise a
+    layout is computed: a spring layout with the known nodes held fixed for
+    graphs up to SPRING_LAYOUT_LIMIT nodes, a spectral layout above it.
+    Layouts computed from scratch (no node in pos) are read from and saved
+    to cache_dir, keyed by the node set; layouts anchored on pos depend on
+    those positions and are not cached.
+
+    Params:
+      graph.......a networkx Graph
+      pos.........optional dict of positions to reuse, e.g. from a larger graph
+      cache_dir...directory for cached layouts (None to disable the cache)
+
+    Returns:
+      A dict from each node to its (x, y) position.
+    """
+
+    known = {n: pos[n] for n in graph.nodes() if pos is not None and n in pos}
+    if len(known) == len(graph):
+        return known
+
+    path = None
+    if cache_dir is not None and not known:
+        path = os.path.join(cache_dir, layout_key(graph) + '.pkl')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+
+    if len(graph) > SPRING_LAYOUT_LIMIT:
+        layout = nx.spectral_layout(graph)
+        layout.update(known)
+    elif known:
+        layout = nx.spring_layout(graph, pos=known, fixed=list(known))
+    else:
+        layout = nx.spring_layout(graph)
+    layout = {n: tuple(float(x) for x in p) for n, p in layout.items()}
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(layout, f)
+
+    return layout
+
+
+def aggregate_graph(graph, pos, label):
+    """
+    Collapse graph into its louvain communities for drawing: one node per
+    community at the mean position of its members, sized by member count,
+    and one edge per connected pair of communities, weighted by the number
+    of edges between them. A community takes the label of a labeled member.
+
+    Returns:
+      community graph, positions, labels, node sizes, edge widths
+    """
+
+    community = louvain(graph)
+    members = defaultdict(list)
+    for n, c in community.items():
+        members[c].append(n)
+    weight = Counter((min(community[a], community[b]), max(community[a], community[b]))
+                     for a, b in graph.edges() if community[a] != community[b])
+
+    agg = nx.Graph()
+    agg.add_nodes_from(members)
+    agg.add_edges_from(weight)
+    agg_pos = {c: tuple(np.mean([pos[n] for n in nodes], axis=0)) for c, nodes in members.items()}
+    agg_label = {community[n]: name for n, name in label.items()}
+    sizes = [20 * len(members[c]) ** .5 for c in agg.nodes()]
+    widths = [.5 * weight[(min(a, b), max(a, b))] ** .5 for a, b in agg.edges()]
+
+    return agg, agg_pos, agg_label, sizes, widths
+
+
+def draw_network(graph, users, filename, pos=None):
     """
     Draw the network to a file.
     Only label the candidate nodes; the friend
     nodes should have no labels (to reduce clutter).
+    Positions come from cached_layout, so passing the positions returned for
+    a larger graph (Network1) keeps its nodes in place in later figures.
+    Graphs over DRAW_NODE_LIMIT nodes are drawn as their communities.
 
     params:
         graph...........the undirected graph created
         users...........list of dicts
         filename........the name of the saved network figure
+        pos.............optional positions to reuse
+
+    Returns:
+        The positions used, a dict from node to (x, y).
     """
 
     #only users have lables
-    label = {}
-    for n in graph.nodes():
-        for u in users:
-            if n in u['id']:
-                label[n] = u['screen_name']
-    
+    names = {u['id']: u['screen_name'] for u in users}
+    label = {n: names[n] for n in graph.nodes() if n in names}
+    pos = cached_layout(graph, pos)
+
     plt.figure(figsize=(15, 15))
     plt.axis('off')
 
-    nx.draw_networkx(graph, labels=label, alpha=.5, node_size=100, width=.5)
+    if len(graph) > DRAW_NODE_LIMIT:
+        agg, agg_pos, agg_label, sizes, widths = aggregate_graph(graph, pos, label)
+        nx.draw_networkx(agg, agg_pos, labels=agg_label, alpha=.5, node_size=sizes, width=widths)
+    else:
+        nx.draw_networkx(graph, pos, labels=label, alpha=.5, node_size=100, width=.5)
     plt.savefig(filename)
+    plt.close()
 
+    return pos
 
-def get_subgraph(graph, min_degree):
+
+def get_subgraph(graph, min_degree, core=False, cores=None):
     """
     Return a subgraph containing nodes whose degree is
     greater than or equal to min_degree.
     To prune the original graph.
+    With core=True, return the min_degree-core (nodes left after repeatedly
+    pruning any with fewer than min_degree neighbors), using
+    CommunityDetection.core_numbers (or the cores given).
 
     Params:
       graph........a networkx graph
       min_degree...degree threshold
+      core.........if True, return the k-core for k=min_degree
+      cores........optional core_numbers(graph), to reuse across thresholds
     Returns:
       a networkx graph, filtered as defined above.
     """
-    
+
+    if core:
+        if cores is None:
+            cores = core_numbers(graph)
+        return graph.subgraph([n for n in graph.nodes() if cores[n] >= min_degree])
+
     sub_nodes = []
     node_list = graph.nodes()
     for node in node_list:
@@ -148,67 +272,6 @@ def get_subgraph(graph, min_degree):
     return subgraph
 
 
-def bfs(graph, root, max_depth):
-    """
-    Perform breadth-first search to compute the shortest paths from a root node to all
-    other nodes in the graph. To reduce running time, the max_depth parameter ends
-    the search after the specified depth.
-
-    Params:
-      graph.......A networkx Graph
-      root........The root node in the search graph (a string). We are computing
-                  shortest paths from this node to all others.
-      max_depth...An integer representing the maximum depth to search.
-
-    Returns:
-      node2distances...dict from each node to the length of the shortest path from
-                       the root node
-      node2num_paths...dict from each node to the number of shortest paths from the
-                       root node that pass through this node.
-      node2parents.....dict from each node to the list of its parents in the search
-                       tree
-    """
-
-    node2parents = {}
-    node2distances = {}
-    node2num_paths = {}
-    visiting = deque()
-    visited = deque()
-    
-    nodes = graph.nodes()
-    visited={x:"No" for x in nodes}
-    visiting.append(root)
-    distance= {x:float("inf") for x in nodes}
-    distance[root] = 0
-    parents = {x:[] for x in nodes} 
-    parents[root] = root
-  
-    while(len(visiting) > 0):
-        c = visiting.popleft()
-        child = graph.neighbors(c)
-            
-        for node in child:
-            if(distance[c] > max_depth):
-                break
-            if(visited[node] == "No"):
-                if(distance[node] < distance[c]):
-                    break
-                elif(distance[node] > distance[c] ):
-                    distance[node] = distance[c] + 1
-                    parents[node].append(c)
-                    visiting.append(node)
-
-        visited[c] = "Yes"
-        
-    for node in visited:
-        if(visited[node] == "Yes"):
-            node2distances[node] = distance[node]
-            node2num_paths[node] = len(parents[node])
-            if(node != root):
-                node2parents[node] = parents[node]
-
-    return node2distances, node2num_paths, node2parents
-    
 def friend_overlap(users):
     """
     Compute the number of common friends of each pair of users.
@@ -224,19 +287,21 @@ def friend_overlap(users):
         user2's screen_name (sorted in ascending alphabetical order).
     """
 
-    pointer = 0
-    friend_overlap = []
-    overlap = tuple()
-    
-    for i in range(0, len(users)):
-        for j in range(i+1, len(users)):
-            for m in range(0, len(users[i]['friends_id'])):
-                for n in range(0, len(users[j]['friends_id'])):
-                    if users[i]['friends_id'][m] == users[j]['friends_id'][n]:
-                        pointer += 1
-            overlap = (users[i]['screen_name'], users[j]['screen_name'], pointer)
-            friend_overlap.append(overlap)
-            pointer = 0
+    # Intern friend ids and count, for every pair of users, the pairs of
+    # equal entries in their friend lists with one sparse product M * M^T.
+    index = {}
+    rows = []
+    cols = []
+    for i, user in enumerate(users):
+        for fnd in user['friends_id']:
+            rows.append(i)
+            cols.append(index.setdefault(fnd, len(index)))
+    incidence = csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(len(users), len(index)))
+    common = (incidence * incidence.T).toarray()
+
+    upper_i, upper_j = np.triu_indices(len(users), 1)
+    friend_overlap = [(users[i]['screen_name'], users[j]['screen_name'], n)
+                      for i, j, n in zip(upper_i.tolist(), upper_j.tolist(), common[upper_i, upper_j].tolist())]
 
     friend_overlap = sorted(friend_overlap, key=lambda tup: (-tup[2], tup[0], tup[1]))
 
@@ -244,67 +309,55 @@ def friend_overlap(users):
 
 
 
-def bottom_up(root, node2distances, node2num_paths, node2parents):
+# Roots are summed in fixed blocks, independent of the number of workers,
+# so serial and parallel runs add the same floats in the same order.
+BETWEENNESS_CHUNK = 256
+
+_worker_graph = {}
+
+
+def _init_betweenness_worker(graph, max_depth):
+    """
+    Pool initializer, so the graph is sent to each worker only once.
     """
-    Compute the final step of the Girvan-Newman algorithm.
+    _worker_graph['graph'] = graph
+    _worker_graph['max_depth'] = max_depth
 
-    Params:
-      root.............The root node in the search graph (a string). We are computing
-                       shortest paths from this node to all others.
-      node2distances...dict from each node to the length of the shortest path from
-                       the root node
-      node2num_paths...dict from each node to the number of shortest paths from the
-                       root node that pass through this node.
-      node2parents.....dict from each node to the list of its parents in the search
-                       tree
-    Returns:
-      A dict mapping edges to credit value. Each key is a tuple of two strings
-      representing an edge (e.g., ('A', 'B')).
+
+def _betweenness_chunk(roots):
+    """
+    Pool task: chunk_credit on the graph sent to this worker.
     """
+    return chunk_credit(_worker_graph['graph'], _worker_graph['max_depth'], roots)
 
-    result = defaultdict()
-    edge_value = deque()
-    node_value = {}
-    
-    for n in node2distances:
-        node_value[n] = 1
-    
-    for nv in node_value:
-        nv = {k:1 for k in node2distances.keys()}
-     
-    for key in sorted(node2distances, key=node2distances.get,reverse=True):
-        if(key != root):
-            for parent in node2parents[key]:
-                nv[parent] = nv[parent] + (nv[key]/len(node2parents[key]))
-                if(key > parent):
-                    edge_value.append((parent, key))
-                elif(key < parent):
-                    edge_value.append((key, parent))
-   
-    for ev in edge_value:
-        if( root in ev):
-            root_index = ev.index(root)
-            if(root_index > 0):
-                result[ev] = (nv[ev[0]]/len(node2parents[ev[0]]))
-            else:
-                result[ev] = (nv[ev[1]]/len(node2parents[ev[1]]))
-        elif(ev[0] in node2parents[ev[1]]):
-            result[ev] = (nv[ev[1]]/len(node2parents[ev[1]]))
-        else:
-            result[ev] = (nv[ev[0]]/len(node2parents[ev[0]]))
+
+def chunk_credit(graph, max_depth, roots):
+    """
+    Sum the bottom_up credit of every edge over a block of roots.
+    """
+    result = defaultdict(float)
+
+    for n in roots:
+        node2distances, node2num_paths, node2parents = bfs(graph, n, max_depth)
+        edge2score = bottom_up(n, node2distances, node2num_paths, node2parents)
+        for a, b in edge2score.items():
+            result[a] += b/2
 
     return result
 
 
-def approximate_betweenness(graph, max_depth):
+def approximate_betweenness(graph, max_depth, workers=None):
     """
     Compute the approximate betweenness of each edge, using max_depth to reduce
     computation time in breadth-first search.
     Only leave the original users nodes and corresponding edges and betweenness for future analysis.
+    With workers > 1 the roots are split across a process pool and the partial
+    sums are added back in the same order as the serial run.
 
     Params:
       graph.......A networkx Graph
       max_depth...An integer representing the maximum depth to search.
+      workers.....number of worker processes (None or 1 runs serially)
 
     Returns:
       A dict mapping edges to betweenness. Each key is a tuple of two strings
@@ -313,19 +366,186 @@ def approximate_betweenness(graph, max_depth):
     """
 
     result = defaultdict(float)
-    
-    for n in graph.nodes():
-        node2distances, node2num_paths, node2parents = bfs(graph, n, max_depth)
-        edge2score = bottom_up(n, node2distances, node2num_paths, node2parents)
-      
-        for a,b in edge2score.items():
-            result[a] += b/2
-   
+    roots = list(graph.nodes())
+    chunks = [roots[i:i + BETWEENNESS_CHUNK] for i in range(0, len(roots), BETWEENNESS_CHUNK)]
+
+    if workers is None or workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            for a, b in chunk_credit(graph, max_depth, chunk).items():
+                result[a] += b
+    else:
+        with Pool(workers, initializer=_init_betweenness_worker, initargs=(graph, max_depth)) as pool:
+            for partial in pool.imap(_betweenness_chunk, chunks):
+                for a, b in partial.items():
+                    result[a] += b
 
     return dict(sorted(result.items()))
 
 
-def partition_girvan_newman(graph, max_depth, num_clusters):
+def build_dendrogram(graph, removal):
+    """
+    Record the whole split hierarchy of an edge removal sequence, with one
+    backwards union-find pass: start from the graph with every edge in
+    removal gone and add them back last to first, creating a merge node each
+    time two components join.
+
+    Leaves 0..V-1 are the nodes of graph in graph.nodes() order and merge
+    node V+i is the i-th join. parent[x] is the merge node x belongs to (-1
+    for the top of each tree) and heights[i] is the removal step at which
+    merge V+i comes apart: its two children are in one component while fewer
+    than heights[i] edges of removal are gone. Merges of edges that are
+    never removed get height len(removal) + 1. Heights never increase with
+    the merge id, so a parent always has a larger id than its children.
+
+    Params:
+      graph.....a networkx Graph
+      removal...list of edges in removal order
+
+    Returns:
+      A dict with the 'nodes' list, the 'parent' and 'heights' lists and
+      the 'removal' sequence.
+
+    >>> g = nx.Graph([('a', 'b'), ('b', 'c'), ('c', 'd')])
+    >>> removal = [('b', 'c'), ('a', 'b'), ('c', 'd')]
+    >>> d = build_dendrogram(g, removal)
+    >>> d['parent'], d['heights']
+    ([5, 5, 4, 4, 6, 6, -1], [3, 2, 1])
+    >>> for t in range(len(removal) + 1):
+    ...     h = g.copy()
+    ...     h.remove_edges_from(removal[:t])
+    ...     components = sorted(sorted(c) for c in nx.connected_components(h))
+    ...     print(t, dendrogram_clusters(d, step=t) == components)
+    0 True
+    1 True
+    2 True
+    3 True
+    >>> dendrogram_labels(d, 2)
+    [0, 1, 4, 4]
+    >>> [dendrogram_step(d, k) for k in (1, 2, 3, 4)]
+    [1, 1, 2, 3]
+    >>> dendrogram_clusters(d, num_clusters=3)
+    [['a'], ['b'], ['c', 'd']]
+    """
+
+    nodes = graph.nodes()
+    index = {n: i for i, n in enumerate(nodes)}
+    uf = list(range(len(nodes)))
+    top = list(range(len(nodes)))
+    parent = [-1] * len(nodes)
+    heights = []
+
+    def find(x):
+        while uf[x] != x:
+            uf[x] = uf[uf[x]]
+            x = uf[x]
+        return x
+
+    def union(a, b, height):
+        a = find(a)
+        b = find(b)
+        if a == b:
+            return
+        merge = len(parent)
+        parent[top[a]] = merge
+        parent[top[b]] = merge
+        parent.append(-1)
+        heights.append(height)
+        uf[b] = a
+        top[a] = merge
+
+    removed = set(frozenset(e) for e in removal)
+    for a, b in graph.edges():
+        if frozenset((a, b)) not in removed:
+            union(index[a], index[b], len(removal) + 1)
+    for i in range(len(removal) - 1, -1, -1):
+        a, b = removal[i]
+        union(index[a], index[b], i + 1)
+
+    return {'nodes': nodes, 'parent': parent, 'heights': heights, 'removal': removal}
+
+
+def dendrogram_step(dendrogram, num_clusters):
+    """
+    The first removal step (at least 1) after which there are at least
+    num_clusters components, or the full length of the removal sequence if
+    that is never reached.
+    The number of components after step t is V minus the number of merges
+    higher than t, so this is read off the sorted heights.
+    """
+
+    heights = dendrogram['heights']
+    num_steps = len(dendrogram['removal'])
+    k = len(dendrogram['nodes']) - num_clusters
+    if k < 0:
+        return num_steps
+    if k >= len(heights):
+        return min(1, num_steps)
+    return min(max(1, heights[k]), num_steps)
+
+
+def dendrogram_labels(dendrogram, step):
+    """
+    Label every node with its component once the first step edges of the
+    removal sequence are gone, in O(V): walk the merges from the top down,
+    letting each one take its parent's label while the parent still holds.
+
+    Returns:
+      A list of component labels, one per node of dendrogram['nodes'].
+    """
+
+    parent = dendrogram['parent']
+    heights = dendrogram['heights']
+    num_nodes = len(dendrogram['nodes'])
+    label = [0] * len(parent)
+    for x in range(len(parent) - 1, -1, -1):
+        p = parent[x]
+        if p >= 0 and heights[p - num_nodes] > step:
+            label[x] = label[p]
+        else:
+            label[x] = x
+
+    return label[:num_nodes]
+
+
+def dendrogram_clusters(dendrogram, num_clusters=None, step=None):
+    """
+    Cut the dendrogram either at num_clusters components (see dendrogram_step)
+    or after a given removal step.
+
+    Returns:
+      A list of node lists, one per component, ordered by their first node
+      in dendrogram['nodes'] (the order connected_component_subgraphs uses).
+    """
+
+    if step is None:
+        step = dendrogram_step(dendrogram, num_clusters)
+    groups = {}
+    for n, l in zip(dendrogram['nodes'], dendrogram_labels(dendrogram, step)):
+        groups.setdefault(l, []).append(n)
+
+    return list(groups.values())
+
+
+def girvan_newman_dendrogram(graph, max_depth, workers=None):
+    """
+    Remove every edge of graph in decreasing order of approximate
+    betweenness and return the build_dendrogram of that sequence.
+    Keep the result and pass it to partition_girvan_newman or
+    dendrogram_clusters to cut it at other cluster counts in O(V). It
+    describes graph as it is now, so build a new one after editing graph.
+
+    Params:
+      graph.......A networkx Graph
+      max_depth...An integer representing the maximum depth to search.
+      workers.....number of processes for approximate_betweenness
+    """
+
+    partition_edge = sorted(approximate_betweenness(graph, max_depth, workers).items(), key=lambda x: (-x[1], x[0]))
+
+    return build_dendrogram(graph, [e for e, b in partition_edge])
+
+
+def partition_girvan_newman(graph, max_depth, num_clusters, workers=None, dendrogram=None, iterative=False):
     """
     Use the approximate_betweenness implementation to partition a graph.
     Unlike in class, here you will not implement this recursively. Instead,
@@ -333,6 +553,9 @@ def partition_girvan_newman(graph, max_depth, num_clusters):
     those components.
     That is, compute the approximate betweenness of all edges, and remove
     them until multiple comonents are created.
+    The removal order is a dendrogram (girvan_newman_dendrogram); pass one
+    built earlier for the same graph to try another num_clusters without
+    recomputing betweenness.
 
     Note: the original graph variable should not be modified. Instead,
     make a copy of the original graph prior to removing edges.
@@ -341,25 +564,485 @@ def partition_girvan_newman(graph, max_depth, num_clusters):
       graph..........A networkx Graph created before
       max_depth......An integer representing the maximum depth to search.
       num_clusters...number of clusters want
+      workers........number of processes for approximate_betweenness
+      dendrogram.....optional girvan_newman_dendrogram(graph, max_depth)
+      iterative......if True, recompute betweenness after every removal
+                     (CommunityDetection.iterative_girvan_newman) until
+                     there are num_clusters components; no dendrogram is used
 
     Returns:
       clusters...........A list of networkx Graph objects, one per partition.
       users_graph........the partitioned users graph.
     """
- 
-    clusters = []
 
-    partition_edge = list(sorted(approximate_betweenness(graph, max_depth).items(), key=lambda x:(-x[1], x[0])))
-    
-    for i in range(0, len(partition_edge)):
-        graph.remove_edge(*partition_edge[i][0])
-        clusters = list(nx.connected_component_subgraphs(graph))
-        if len(clusters) >= num_clusters:
+    if iterative:
+        users_graph = graph.copy()
+        splits = num_clusters - nx.number_connected_components(graph)
+        if splits > 0:
+            users_graph.remove_edges_from(iterative_girvan_newman(graph, max_depth, splits=splits))
+        clusters = [c for c in nx.connected_component_subgraphs(users_graph) if len(c) > 1]
+        return clusters, users_graph
+
+    if dendrogram is None:
+        dendrogram = girvan_newman_dendrogram(graph, max_depth, workers)
+    steps = dendrogram_step(dendrogram, num_clusters)
+    users_graph = graph.copy()
+    users_graph.remove_edges_from(dendrogram['removal'][:steps])
+    if steps == 0:
+        return [], users_graph
+
+    new_clusters = [users_graph.subgraph(nodes) for nodes in dendrogram_clusters(dendrogram, step=steps) if len(nodes) > 1]
+
+    return new_clusters, users_graph
+
+
+def int_adjacency(graph):
+    """
+    Integer-indexed weighted adjacency of a graph for the Louvain functions.
+
+    Returns:
+      nodes.....graph.nodes(), so node i is nodes[i]
+      index.....dict from node to its integer id
+      adj.......list of dicts, adj[i][j] = weight of edge i-j (no self-loops)
+      loops.....list of self-loop weights
+    """
+
+    nodes = graph.nodes()
+    index = {n: i for i, n in enumerate(nodes)}
+    adj = [{} for n in nodes]
+    loops = [0.0] * len(nodes)
+    for a, b in graph.edges():
+        i = index[a]
+        j = index[b]
+        if i == j:
+            loops[i] += 1.0
+        else:
+            adj[i][j] = adj[i].get(j, 0.0) + 1.0
+            adj[j][i] = adj[j].get(i, 0.0) + 1.0
+
+    return nodes, index, adj, loops
+
+
+def local_moves(adj, degree, labels, tot, m2, queue, moved=None):
+    """
+    Louvain local moving phase. Pop nodes from queue and move each to the
+    neighboring community with the largest modularity gain
+    k_i,in(c) - tot(c) * k_i / 2m, staying put on ties; when a node moves,
+    its neighbors are queued again. labels and tot (the total degree of each
+    community) are updated in place. adj, degree, labels and tot may be
+    lists or dicts; each adj[i] maps a neighbor to the edge weight.
+    If moved is a list, (node, old label, new label) is appended for each move.
+
+    Returns:
+      The number of moves made.
+    """
+
+    queued = set(queue)
+    queue = deque(queue)
+    moves = 0
+    while queue:
+        i = queue.popleft()
+        queued.discard(i)
+        current = labels[i]
+        k_i = degree[i]
+        links = {}
+        for j, w in adj[i].items():
+            c = labels[j]
+            links[c] = links.get(c, 0.0) + w
+        tot[current] -= k_i
+        best = current
+        best_gain = links.get(current, 0.0) - tot[current] * k_i / m2
+        for c, w in links.items():
+            gain = w - tot[c] * k_i / m2
+            if gain > best_gain:
+                best, best_gain = c, gain
+        tot[best] += k_i
+        if best != current:
+            labels[i] = best
+            moves += 1
+            if moved is not None:
+                moved.append((i, current, best))
+            for j in adj[i]:
+                if j not in queued:
+                    queued.add(j)
+                    queue.append(j)
+
+    return moves
+
+
+def aggregate(adj, loops, labels):
+    """
+    Louvain aggregation phase: collapse each community into one node.
+
+    Returns:
+      members....list of the old node ids in each new node
+      adj........adjacency of the community graph
+      loops......weight of the edges inside each community
+    """
+
+    renumber = {}
+    members = []
+    for i, c in enumerate(labels):
+        if c not in renumber:
+            renumber[c] = len(members)
+            members.append([])
+        members[renumber[c]].append(i)
+
+    new_adj = [{} for c in members]
+    new_loops = [0.0] * len(members)
+    for i, nbrs in enumerate(adj):
+        ci = renumber[labels[i]]
+        new_loops[ci] += loops[i]
+        for j, w in nbrs.items():
+            cj = renumber[labels[j]]
+            if ci == cj:
+                new_loops[ci] += w / 2
+            else:
+                new_adj[ci][cj] = new_adj[ci].get(cj, 0.0) + w
+
+    return members, new_adj, new_loops
+
+
+def louvain(graph):
+    """
+    Louvain community detection (Blondel et al. 2008): alternate
+    local_moves and aggregate on the integer adjacency until no node moves.
+    Nodes are visited in graph.nodes() order, so the result is deterministic.
+    Each level costs O(E), against O(V*E^2) for partition_girvan_newman.
+
+    Params:
+      graph...a networkx Graph
+
+    Returns:
+      A dict from each node to an integer community label.
+    """
+
+    nodes, _, adj, loops = int_adjacency(graph)
+    community = list(range(len(nodes)))
+    while adj:
+        degree = [sum(nbrs.values()) + 2 * l for nbrs, l in zip(adj, loops)]
+        m2 = sum(degree)
+        if m2 == 0:
+            break
+        labels = list(range(len(adj)))
+        tot = list(degree)
+        if local_moves(adj, degree, labels, tot, m2, range(len(adj))) == 0:
             break
+        members, adj, loops = aggregate(adj, loops, labels)
+        level = [0] * len(labels)
+        for c, group in enumerate(members):
+            for i in group:
+                level[i] = c
+        community = [level[c] for c in community]
+
+    return {n: community[i] for i, n in enumerate(nodes)}
+
+
+def clusters_from_labels(labels):
+    """
+    Group nodes by label, in order of each group's first node.
+
+    Returns:
+      A list of node lists.
+    """
+
+    groups = {}
+    for n, l in labels.items():
+        groups.setdefault(l, []).append(n)
+
+    return list(groups.values())
+
+
+def partition_quality(graph, clusters):
+    """
+    Score a partition by modularity and by normalized cut, the sum over
+    clusters of cut(C) / volume(C). Nodes outside every cluster (the
+    dropped singletons) count as clusters of their own.
+
+    Params:
+      graph......a networkx Graph
+      clusters...an iterable of clusters, each an iterable of nodes
+                 (networkx graphs work)
+
+    Returns:
+      modularity, norm_cut
+    """
+
+    label = {}
+    for c, cluster in enumerate(clusters):
+        for n in cluster:
+            label[n] = c
+    for n in graph.nodes():
+        if n not in label:
+            label[n] = ('singleton', n)
+
+    inside = defaultdict(float)
+    cut = defaultdict(float)
+    volume = defaultdict(float)
+    m = 0
+    for a, b in graph.edges():
+        m += 1
+        volume[label[a]] += 1
+        volume[label[b]] += 1
+        if label[a] == label[b]:
+            inside[label[a]] += 1
+        else:
+            cut[label[a]] += 1
+            cut[label[b]] += 1
+    if m == 0:
+        return 0.0, 0.0
+
+    modularity = sum(inside[c] / m - (volume[c] / (2 * m)) ** 2 for c in volume)
+    norm_cut = sum(cut[c] / volume[c] for c in volume if volume[c])
+
+    return modularity, norm_cut
+
+
+def partition_louvain(graph):
+    """
+    Partition a graph with louvain, returning the same values as
+    partition_girvan_newman: the clusters with more than one node as
+    networkx graphs, and a copy of graph without the edges between clusters.
+    """
+
+    return partition_from_labels(graph, louvain(graph))
+
 
-    new_clusters = [cluster for cluster in clusters if len(cluster.nodes()) > 1]
+def partition_from_labels(graph, labels):
+    """
+    The clusters with more than one node as networkx graphs, and a copy of
+    graph without the edges between clusters, for a dict of node labels.
+    """
+
+    users_graph = graph.copy()
+    users_graph.remove_edges_from([(a, b) for a, b in graph.edges() if labels[a] != labels[b]])
+    clusters = [users_graph.subgraph(nodes) for nodes in clusters_from_labels(labels) if len(nodes) > 1]
+
+    return clusters, users_graph
+
+
+class _UnitWeights(object):
+    """
+    graph.adj seen as neighbor -> weight 1.0 dicts, built per lookup, so
+    local_moves can run on a networkx graph without copying it.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, n):
+        return {m: 1.0 for m in self.graph.neighbors(n) if m != n}
+
+
+def community_state(graph, labels):
+    """
+    Summarize a partition for update_communities: node degrees, the total
+    degree and inside edge count of each community, and the two sums that
+    give modularity, sum(inside) / m - sum(tot^2) / (2m)^2. O(E), run once
+    after each full clustering.
+
+    Params:
+      graph....a networkx Graph without self-loops
+      labels...dict from each node to an integer community label
+
+    Returns:
+      A dict holding the labels and these totals. 'baseline' is the
+      modularity right after the clustering.
+    """
+
+    degree = {n: graph.degree(n) for n in graph.nodes()}
+    tot = defaultdict(float)
+    inside = defaultdict(float)
+    for n, d in degree.items():
+        tot[labels[n]] += d
+    for a, b in graph.edges():
+        if labels[a] == labels[b]:
+            inside[labels[a]] += 1
+    state = {'labels': dict(labels), 'degree': degree, 'tot': tot, 'inside': inside,
+             'm': graph.number_of_edges(), 'sum_inside': sum(inside.values()),
+             'sum_tot2': sum(t * t for t in tot.values()),
+             'next_label': max(labels.values()) + 1 if labels else 0}
+    state['baseline'] = state_modularity(state)
+
+    return state
+
+
+def state_modularity(state):
+    """
+    Modularity of the partition held by a community_state, in O(1).
+    """
 
-    return new_clusters, graph
+    m = state['m']
+    if m == 0:
+        return 0.0
+    return state['sum_inside'] / m - state['sum_tot2'] / (4.0 * m * m)
+
+
+def _shift_tot(state, label, delta):
+    tot = state['tot']
+    state['sum_tot2'] += delta * (2 * tot[label] + delta)
+    tot[label] += delta
+
+
+def _shift_inside(state, label, delta):
+    state['inside'][label] += delta
+    state['sum_inside'] += delta
+
+
+def update_communities(graph, state, added=(), removed=(), max_drop=0.05):
+    """
+    Keep a Louvain partition current as edges arrive and go, without
+    reclustering from zero. The edge delta is applied to graph and to the
+    community totals in O(1) per edge, new nodes start in communities of
+    their own, and local_moves runs from the endpoints of the changed edges
+    only, spreading to neighbors just where nodes actually move. The cost is
+    proportional to the delta and the neighborhoods it disturbs.
+    If modularity falls more than max_drop below its value after the last
+    full clustering, the graph is reclustered with louvain and the state
+    rebuilt.
+
+    Params:
+      graph......the networkx Graph the state was built from; modified in place
+      state......a community_state dict; modified in place
+      added......edges to add
+      removed....edges to remove
+      max_drop...allowed loss of modularity before a full recluster
+
+    Returns:
+      True if a full recluster was done, False otherwise.
+
+    >>> g = nx.Graph([('a', 'b'), ('b', 'c'), ('a', 'c'), ('d', 'e'),
+    ...               ('e', 'f'), ('d', 'f'), ('c', 'd')])
+    >>> state = community_state(g, louvain(g))
+    >>> update_communities(g, state, added=[('f', 'g'), ('g', 'e'), ('a', 'e')],
+    ...                    removed=[('c', 'd')])
+    False
+    >>> fresh = community_state(g, state['labels'])
+    >>> [state[k] == fresh[k] for k in ('m', 'sum_inside', 'sum_tot2')]
+    [True, True, True]
+    """
+
+    labels = state['labels']
+    degree = state['degree']
+    touched = []
+
+    for a, b in removed:
+        if a == b or not graph.has_edge(a, b):
+            continue
+        graph.remove_edge(a, b)
+        state['m'] -= 1
+        for n in (a, b):
+            degree[n] -= 1
+            _shift_tot(state, labels[n], -1)
+            touched.append(n)
+        if labels[a] == labels[b]:
+            _shift_inside(state, labels[a], -1)
+
+    for a, b in added:
+        if a == b or graph.has_edge(a, b):
+            continue
+        for n in (a, b):
+            if n not in labels:
+                labels[n] = state['next_label']
+                state['next_label'] += 1
+                degree[n] = 0
+        graph.add_edge(a, b)
+        state['m'] += 1
+        for n in (a, b):
+            degree[n] += 1
+            _shift_tot(state, labels[n], 1)
+            touched.append(n)
+        if labels[a] == labels[b]:
+            _shift_inside(state, labels[a], 1)
+
+    if state['m'] == 0:
+        return False
+
+    # local_moves changes labels and tot; replay its moves on the sums.
+    tot = state['tot']
+    old_labels = {}
+    change = defaultdict(float)
+    moved = []
+    adj = _UnitWeights(graph)
+    local_moves(adj, degree, labels, tot, 2.0 * state['m'], list(dict.fromkeys(touched)), moved)
+    for n, old, new in moved:
+        old_labels.setdefault(n, old)
+        change[old] -= degree[n]
+        change[new] += degree[n]
+    for c, d in change.items():
+        state['sum_tot2'] += tot[c] ** 2 - (tot[c] - d) ** 2
+    seen = set()
+    for n in old_labels:
+        for m in adj[n]:
+            edge = frozenset((n, m))
+            if edge in seen:
+                continue
+            seen.add(edge)
+            old_a = old_labels[n]
+            old_b = old_labels.get(m, labels[m])
+            if old_a == old_b:
+                _shift_inside(state, old_a, -1)
+            if labels[n] == labels[m]:
+                _shift_inside(state, labels[n], 1)
+
+    if state_modularity(state) < state['baseline'] - max_drop:
+        state.clear()
+        state.update(community_state(graph, louvain(graph)))
+        return True
+
+    return False
+
+
+def graph_delta(old_graph, new_graph):
+    """
+    The edges to add to and remove from old_graph to get new_graph's edges.
+
+    Returns:
+      added, removed: two lists of edges.
+    """
+
+    added = [(a, b) for a, b in new_graph.edges() if not old_graph.has_edge(a, b)]
+    removed = [(a, b) for a, b in old_graph.edges() if not new_graph.has_edge(a, b)]
+
+    return added, removed
+
+
+def partition(graph, method='girvan_newman', max_depth=5, num_clusters=100, workers=None):
+    """
+    Partition a graph with the chosen engine: 'girvan_newman' (max_depth,
+    num_clusters and workers apply), 'iterative_girvan_newman' (the same,
+    recomputing betweenness after each removal) or 'louvain'.
+
+    Returns:
+      clusters, users_graph as partition_girvan_newman does.
+    """
+
+    if method == 'girvan_newman':
+        return partition_girvan_newman(graph, max_depth, num_clusters, workers)
+    if method == 'iterative_girvan_newman':
+        return partition_girvan_newman(graph, max_depth, num_clusters, workers, iterative=True)
+    if method == 'louvain':
+        return partition_louvain(graph)
+    raise ValueError('unknown clustering method: %s' % method)
+
+
+def compare_partitions(graph, methods=('girvan_newman', 'louvain'), max_depth=5, num_clusters=100, workers=None):
+    """
+    Run each partition method on graph and report its quality and runtime.
+
+    Returns:
+      A list of (method, number of clusters, modularity, norm_cut, seconds).
+    """
+
+    rows = []
+    for method in methods:
+        start = time.time()
+        clusters, users_graph = partition(graph, method, max_depth, num_clusters, workers)
+        seconds = time.time() - start
+        modularity, norm_cut = partition_quality(graph, clusters)
+        rows.append((method, len(clusters), modularity, norm_cut, seconds))
+
+    return rows
 
 
 def save_obj(obj, name):
@@ -367,7 +1050,19 @@ def save_obj(obj, name):
         pickle.dump(obj, f)
 
 
-def main():
+def load_obj(name):
+    with open(name + '.pkl', 'rb') as f:
+        return pickle.load(f)
+
+
+def main(method='girvan_newman'):
+    """
+    method is 'girvan_newman' or 'iterative_girvan_newman' (the min_common=1
+    subgraph), 'louvain' (the
+    full graph, updated from the previous run's communities.pkl with
+    update_communities when it exists) or 'compare', which also prints the
+    quality and runtime of both on the full graph.
+    """
     users = get_user_info('twit_user')
     print("Fetched user data.")
     print('Number of friends of each user:')
@@ -378,26 +1073,54 @@ def main():
     
     graph = create_graph(users, friend_counts, 0)
     print('graph has %s nodes and %s edges' % (len(graph.nodes()), len(graph.edges())))
-    draw_network(graph, users, 'Network1.png')
+    pos = draw_network(graph, users, 'Network1.png')
     print('network drawn to Network1.png')
 
     subgraph = create_graph(users, friend_counts, 1)
     print('subgraph has %s nodes and %s edges' % (len(subgraph.nodes()), len(subgraph.edges())))
-    draw_network(subgraph, users, 'Network2.png')
+    draw_network(subgraph, users, 'Network2.png', pos)
     print('network drawn to network2.png')
     
-    clusters, partitioned_graph = partition_girvan_newman(subgraph, 5, 100)
+    if method == 'compare':
+        for row in compare_partitions(graph):
+            print('%s: %d clusters, modularity %.4f, norm_cut %.4f, %.2f seconds' % row)
+
+    if method == 'louvain':
+        # Update the communities of the previous run when there is one.
+        if os.path.exists('communities.pkl'):
+            community_graph, state = load_obj('communities')
+            added, removed = graph_delta(community_graph, graph)
+            if update_communities(community_graph, state, added, removed):
+                print('modularity dropped too far, reclustered from scratch')
+            print('updated communities for %d new and %d removed edges' % (len(added), len(removed)))
+        else:
+            community_graph = graph.copy()
+            state = community_state(community_graph, louvain(community_graph))
+        save_obj((community_graph, state), 'communities')
+        clusters, partitioned_graph = partition_from_labels(community_graph, state['labels'])
+        # A dendrogram from an earlier Girvan-Newman run does not describe
+        # these clusters; summarize.py only reports it when present.
+        if os.path.exists('dendrogram.pkl'):
+            os.remove('dendrogram.pkl')
+    elif method == 'iterative_girvan_newman':
+        clusters, partitioned_graph = partition_girvan_newman(subgraph, 5, 100, iterative=True)
+        if os.path.exists('dendrogram.pkl'):
+            os.remove('dendrogram.pkl')
+    else:
+        dendrogram = girvan_newman_dendrogram(subgraph, 5)
+        clusters, partitioned_graph = partition_girvan_newman(subgraph, 5, 100, dendrogram=dendrogram)
+        save_obj(dendrogram, 'dendrogram')
     save_obj(clusters, 'clusters')
 
     print('cluster 1 has %d nodes, cluster 2 has %d nodes, cluster 3 has %d nodes' %
           (len(clusters[0].nodes()), len(clusters[1].nodes()), len(clusters[2].nodes())))
 
-    draw_network(partitioned_graph, users, 'Network3.png')
+    draw_network(partitioned_graph, users, 'Network3.png', pos)
     print('network drawn to Network3.png')
 
 
 if __name__ == '__main__':
-    main()
+    main(*sys.argv[1:2])
 
 
 
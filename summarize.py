@@ -5,7 +5,9 @@ Read the output and colleted data and writes to summary.txt
 """
 
 
+import os
 import pickle
+from cluster import dendrogram_clusters
 
 
 def get_obj(name):
@@ -26,6 +28,23 @@ def ave_num_clusters(clusters):
     return ave
 
 
+def cluster_granularities(dendrogram, sizes):
+    """
+    Cut the stored Girvan-Newman dendrogram at each requested number of
+    clusters. Singletons are left out, as in cluster.partition_girvan_newman.
+
+    Returns:
+      A list of (requested, communities found, average users per community).
+    """
+    report = []
+    for size in sizes:
+        clusters = [c for c in dendrogram_clusters(dendrogram, num_clusters=size) if len(c) > 1]
+        ave = sum(len(c) for c in clusters) / len(clusters) if clusters else 0
+        report.append((size, len(clusters), ave))
+
+    return report
+
+
 def main():
     text_file = open('summary.txt', 'w')
     text_file.write("Number of users collected:\n")
@@ -51,6 +70,12 @@ def main():
     a_n_clusters = ave_num_clusters(clusters)
     text_file.write('Average number of users per community: %d\n' % (a_n_clusters))
     text_file.write('\n')
+    if os.path.exists('dendrogram.pkl'):
+        text_file.write('Communities at other granularities:\n')
+        text_file.write('\n')
+        for size, found, ave in cluster_granularities(get_obj('dendrogram'), [5, 10, 50, 100, 200]):
+            text_file.write('Asking for %d clusters gives %d communities of %d users on average.\n' % (size, found, ave))
+        text_file.write('\n')
     text_file.write('Number of instances per class found:\n')
     text_file.write('\n')
     text_file.write('There are three classes for sentiment analysis.\n')